@@ -18,7 +18,69 @@ if 'VCAP_SERVICES' in os.environ:
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool of each worker process: DB_POOL_SIZE connections are kept
+# open and up to DB_MAX_OVERFLOW more are opened under load. A request waits
+# at most DB_POOL_TIMEOUT seconds for a connection, connections older than
+# DB_POOL_RECYCLE seconds are replaced (-1 never), and DB_POOL_PRE_PING tests
+# each connection before it is handed out.
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "2")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "-1")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "false").lower() in ("true", "1", "yes"),
+}
+# The async serving mode (service/asgi.py) runs every request of a process on
+# one engine, so it keeps more connections open
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+
+# Check the schema against a version stamp on startup instead of creating the
+# tables, which saves the catalog queries of db.create_all() on every boot
+FAST_START = os.getenv("FAST_START", "false").lower() in ("true", "1", "yes")
+
+# Read-through cache for lookups by source product (a size of 0 turns it off)
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024"))
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "30"))
+
+# Concurrent identical reads in one process share a single database query
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() in ("true", "1", "yes")
+
+# Commit the creates of concurrent requests together: a batch waits up to
+# GROUP_COMMIT_WINDOW_MS for more rows and holds at most GROUP_COMMIT_MAX_ROWS
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "false").lower() in ("true", "1", "yes")
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "100"))
+
+# Serve lookups by source product from an in-memory snapshot of the table
+ADJACENCY_SNAPSHOT = os.getenv("ADJACENCY_SNAPSHOT", "false").lower() in ("true", "1", "yes")
+ADJACENCY_REFRESH_INTERVAL = float(os.getenv("ADJACENCY_REFRESH_INTERVAL", "60"))
+# Graph file shared by every worker, written by `flask export-graph`
+ADJACENCY_GRAPH_FILE = os.getenv("ADJACENCY_GRAPH_FILE")
+
+# Keyset pagination of list endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched per round trip when streaming a listing
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Largest number of items accepted by one bulk create request
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+
+# Largest number of source products in one batch lookup
+MAX_LOOKUP_IDS = int(os.getenv("MAX_LOOKUP_IDS", "100"))
+
+# Send a Server-Timing header and log the handler, SQL and serialization
+# time of every request
+REQUEST_TIMING = os.getenv("REQUEST_TIMING", "false").lower() in ("true", "1", "yes")
+
+# Log SQL statements slower than SLOW_QUERY_MS milliseconds (0 turns it off),
+# with their parameters only if SLOW_QUERY_LOG_PARAMS is set, and their
+# query plans if SLOW_QUERY_EXPLAIN is set
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+SLOW_QUERY_LOG_PARAMS = os.getenv("SLOW_QUERY_LOG_PARAMS", "false").lower() in ("true", "1", "yes")
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() in ("true", "1", "yes")
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
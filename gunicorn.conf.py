@@ -0,0 +1,74 @@
+"""
+Gunicorn settings
+
+Gunicorn reads this file from the working directory on startup.
+
+By default the service runs one worker per core the process may run on (its
+CPU affinity, not every core of the host; WEB_CONCURRENCY overrides it) with
+the app preloaded: the master imports the service once, which
+creates the tables and builds the snapshot when ADJACENCY_SNAPSHOT is set,
+and the workers are forked from it. The garbage collector is kept off in the
+master and every object is frozen before a fork, so collections in the
+workers do not write to the pages they share with the master. The master
+closes its database connections before forking and each worker starts with
+a pool of its own. GUNICORN_PRELOAD=false loads the app in each worker
+instead.
+
+When PROMETHEUS_MULTIPROC_DIR is set, every worker writes its metrics to
+files in that directory and /metrics adds them up. The directory is emptied
+when the server starts, and the files of a worker that exits are marked dead
+so that its in-flight gauge no longer counts.
+"""
+import gc
+import glob
+import multiprocessing
+import os
+import sys
+
+def usable_cpus() -> int:
+    """Returns the number of cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()  # no affinity outside Linux
+
+
+workers = int(os.getenv("WEB_CONCURRENCY", str(usable_cpus())))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("true", "1", "yes")
+
+if preload_app:
+    # no collections while the app loads, so no freed holes in shared pages
+    gc.disable()
+
+
+def on_starting(server):
+    """Removes the metrics of the previous run"""
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+
+
+def pre_fork(server, worker):
+    """Closes the connections of the master and freezes its objects"""
+    if server.cfg.preload_app:
+        from service.models import Recommendation  # pylint: disable=import-outside-toplevel
+        Recommendation.before_fork()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """Gives the worker its own database pools and turns the collector back on"""
+    if server.cfg.preload_app:
+        from service.models import Recommendation  # pylint: disable=import-outside-toplevel
+        Recommendation.after_fork()
+        if "service.async_models" in sys.modules:  # only loaded in async mode
+            sys.modules["service.async_models"].AsyncRecommendation.after_fork()
+    gc.enable()
+
+
+def child_exit(server, worker):
+    """Marks the metrics of an exited worker as dead"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+        multiprocess.mark_process_dead(worker.pid)
@@ -14,8 +14,13 @@ app = Flask(__name__)
 app.config.from_object("config")
 
 # Import the routes After the Flask app is created
-from service import routes, models
-from .utils import error_handlers
+from service import routes, models, commands
+from .utils import error_handlers, metrics, timing
+
+# Record request metrics for /metrics and time each request when
+# REQUEST_TIMING is set
+metrics.init_app(app)
+timing.init_app(app)
 
 # Set up logging for production
 if __name__ != "__main__":
@@ -0,0 +1,217 @@
+"""
+Async serving mode
+
+An ASGI application for running the service on an asyncio server such as
+uvicorn, where one process keeps thousands of keep-alive connections open:
+
+  uvicorn service.asgi:app --host 0.0.0.0 --port 8080
+  gunicorn -k uvicorn.workers.UvicornWorker service.asgi:app
+
+The read endpoints that carry most of the traffic are answered natively on
+the event loop through AsyncRecommendation:
+
+  GET /recommendations and GET /api/recommendations (paged listings)
+  GET /recommendations/<id> and GET /api/recommendations/<id>
+
+Every other request, and any read the fast path does not handle the same way
+(validation errors, missing recommendations, batch lookups, streaming, field
+masks, the in-memory snapshot), is passed on to the Flask app, which runs on
+a small thread pool. Both serve the same JSON contract from the same cache.
+
+Requests answered natively are recorded in the Prometheus metrics under the
+URL rule of the Flask route they stand in for, and carry a Server-Timing
+header when REQUEST_TIMING is set. That header only has the total time, as
+the async queries are not timed one by one.
+"""
+import json
+import re
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.http import generate_etag, parse_accept_header, parse_etags, quote_etag
+
+from service import app as flask_app
+from service.async_models import AsyncRecommendation
+from service.models import DataValidationError, Recommendation, src_snapshot, src_versions
+from service.routes import NDJSON, cached_source_id, get_filters, get_page_args, get_top, page_of
+from service.utils import metrics, status, timing
+
+LIST_PATHS = ("/recommendations", "/api/recommendations")
+ITEM_PATH = re.compile(r"^(?:/api)?/recommendations/(\d+)$")
+
+
+class RecommendationASGI:
+    """Serves the hot read endpoints on the event loop and everything else with Flask"""
+
+    def __init__(self, wsgi_app, wsgi_workers: int = 10):
+        self.flask_app = wsgi_app
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=wsgi_workers)
+        self._rules = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        route = self.route_rule(scope["path"]) if scope["type"] == "http" and scope["method"] == "GET" else None
+        if route is not None:
+            started = time.perf_counter()
+            metrics.IN_PROGRESS.labels("GET", route).inc()
+            try:
+                response = await self.handle(scope)
+                if response is not None:
+                    code, headers, body = response
+                    if self.flask_app.config.get("REQUEST_TIMING"):
+                        total = time.perf_counter() - started
+                        headers.append(("server-timing", timing.report("GET", scope["path"], route, code, total)))
+                    await self.send_response(send, code, headers, body)
+                    size = len(body) if code != status.HTTP_304_NOT_MODIFIED else None
+                    metrics.observe("GET", route, code, time.perf_counter() - started, size)
+                    return
+            finally:
+                metrics.IN_PROGRESS.labels("GET", route).dec()
+        await self.wsgi(scope, receive, send)
+
+    def route_rule(self, path: str):
+        """Returns the Flask URL rule of a path the fast path may answer, or None for any other path"""
+        if path not in LIST_PATHS:
+            match = ITEM_PATH.match(path)
+            if match is None:
+                return None
+            path = path[:match.start(1)] + "0"  # one rule per kind of path, whatever the id
+        rule = self._rules.get(path)
+        if rule is None:
+            adapter = self.flask_app.url_map.bind("localhost")
+            rule = self._rules[path] = adapter.match(path, method="GET", return_rule=True)[0].rule
+        return rule
+
+    async def lifespan(self, receive, send):
+        """Opens the async engine on startup and closes it on shutdown"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                AsyncRecommendation.init_db(self.flask_app)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await AsyncRecommendation.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def handle(self, scope):
+        """Returns a (status, headers, body) response, or None to pass the request to Flask"""
+        if AsyncRecommendation.engine is None:
+            AsyncRecommendation.init_db(self.flask_app)
+        request = Request(scope)
+        if request.path in LIST_PATHS:
+            return await self.list_recommendations(request)
+        match = ITEM_PATH.match(request.path)
+        if match:
+            return await self.get_recommendation(request, int(match.group(1)))
+        return None
+
+    async def list_recommendations(self, request):
+        """Returns one page of Recommendations, like list_response() in service.routes"""
+        args = request.args
+        if "," in args.get("src_product_id", "") or request.streaming or request.fields_mask:
+            return None
+        try:
+            filters = get_filters(args)
+            limit, after = get_page_args(args.get("limit"), args.get("after"))
+            top = get_top(args.get("top"))
+            source_id = cached_source_id(filters)
+            if source_id is None:
+                if top is not None:
+                    rows, next_cursor = await AsyncRecommendation.find_top_rows(top, **filters), None
+                else:
+                    rows, next_cursor = await AsyncRecommendation.find_rows_page(limit, after, **filters)
+                body = ("[" + ",".join(Recommendation.serialize_rows_json(rows)) + "]").encode()
+                return request.conditional(body, generate_etag(body), request.page_headers(next_cursor, limit))
+        except DataValidationError:
+            return None
+        if src_snapshot.enabled:
+            return None
+        etag = src_versions.tag(source_id)  # before the data, see VersionTags.tag()
+        if top is not None:
+            etag += ".top{}".format(top)
+        if request.etag_matches(etag):
+            return request.not_modified(etag)
+        if top is not None:
+            results, next_cursor = await AsyncRecommendation.find_top_by_src_id_cached(source_id, top), None
+        else:
+            results, next_cursor = page_of(await AsyncRecommendation.find_by_src_id_cached(source_id), limit, after)
+        body = json.dumps(results).encode()
+        return request.conditional(body, etag, request.page_headers(next_cursor, limit))
+
+    async def get_recommendation(self, request, id):
+        """Returns a single Recommendation, like row_response() in service.routes"""
+        if request.fields_mask:
+            return None
+        row = await AsyncRecommendation.find_row(id)
+        if row is None:
+            return None
+        body = Recommendation.serialize_rows_json([row])[0].encode()
+        return request.conditional(body, generate_etag(body))
+
+    @staticmethod
+    async def send_response(send, code, headers, body):
+        """Sends a complete JSON response"""
+        headers = [(name.encode(), value.encode()) for name, value in headers]
+        if code != status.HTTP_304_NOT_MODIFIED:
+            headers.append((b"content-type", b"application/json"))
+            headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+class Request:
+    """The parts of an ASGI HTTP request that the fast path reads"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.path = scope["path"]
+        self.headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        self.args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+
+    @property
+    def streaming(self) -> bool:
+        """Checks whether the client asked for a streamed listing, like stream_requested()"""
+        if parse_accept_header(self.headers.get("accept"), MIMEAccept).best == NDJSON:
+            return True
+        return self.args.get("stream", "").lower() in ("true", "1", "yes")
+
+    @property
+    def fields_mask(self) -> bool:
+        """Checks for a Flask-RESTX field mask header"""
+        return flask_app.config["RESTX_MASK_HEADER"].lower() in self.headers
+
+    def etag_matches(self, etag: str) -> bool:
+        """Checks whether If-None-Match names etag"""
+        return parse_etags(self.headers.get("if-none-match")).contains(etag)
+
+    def conditional(self, body: bytes, etag: str, headers: list = ()):
+        """Returns a 200 response tagged with etag, or 304 when the client has it"""
+        if self.etag_matches(etag):
+            return self.not_modified(etag, headers)
+        return status.HTTP_200_OK, list(headers) + [("etag", quote_etag(etag))], body
+
+    @staticmethod
+    def not_modified(etag: str, headers: list = ()):
+        """Returns an empty 304 response tagged with etag"""
+        return status.HTTP_304_NOT_MODIFIED, list(headers) + [("etag", quote_etag(etag))], b""
+
+    def page_headers(self, next_cursor, limit) -> list:
+        """Returns a Link header pointing at the next page, like page_headers() in service.routes"""
+        if next_cursor is None:
+            return []
+        args = self.args.to_dict()
+        args.update(limit=limit, after=next_cursor)
+        host = self.headers.get("host")
+        if host is None:
+            server_host, port = self.scope["server"]
+            host = "{}:{}".format(server_host, port)
+        base_url = "{}://{}{}{}".format(self.scope["scheme"], host, self.scope.get("root_path", ""), self.path)
+        return [("link", '<{}?{}>; rel="next"'.format(base_url, urlencode(args)))]
+
+
+app = RecommendationASGI(flask_app)
@@ -0,0 +1,124 @@
+"""
+Async queries for Recommendations
+
+The read queries of the Recommendation model run on an asyncio engine
+(SQLAlchemy's asyncio extension with the asyncpg driver), for the async
+serving mode in service/asgi.py. The statements are the ones the sync model
+builds, and lookups by source product share its read-through cache, so both
+serving modes return the same data and see each other's writes. Concurrent
+identical lookups on the event loop share one query through read_flights.
+
+Queries run on plain async connections rather than ORM sessions since only
+Core statements are executed, and the statements of the two lookups that
+carry most of the traffic are built once with bound parameters.
+
+The engine is created on first use, inside the event loop that uses it.
+"""
+import logging
+
+from sqlalchemy import bindparam
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from service.models import Recommendation, read_flights, src_cache
+
+logger = logging.getLogger("flask.app")
+
+# the pool settings of SQLALCHEMY_ENGINE_OPTIONS that apply to an async engine
+POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping")
+
+ROW_BY_ID = Recommendation._row_select({}).where(Recommendation.__table__.c.id == bindparam("id"))
+ROWS_BY_SOURCE = Recommendation._row_select({}).where(
+    Recommendation.__table__.c.src_product_id == bindparam("source_id")
+)
+
+
+def async_database_uri(uri: str) -> str:
+    """Returns a postgresql:// database URI with the asyncpg driver"""
+    url = make_url(uri)
+    return str(url.set(drivername=url.get_backend_name() + "+asyncpg"))
+
+
+class AsyncRecommendation:
+    """Runs Recommendation read queries on an asyncio engine"""
+
+    engine = None
+
+    @classmethod
+    def init_db(cls, app):
+        """Creates the async engine from the Flask app config"""
+        options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+        options = {name: options[name] for name in POOL_OPTIONS if name in options}
+        options["pool_size"] = app.config.get("ASYNC_DB_POOL_SIZE", options.get("pool_size", 5))
+        cls.engine = create_async_engine(async_database_uri(app.config["SQLALCHEMY_DATABASE_URI"]), **options)
+        logger.info("Initialized async database engine")
+
+    @classmethod
+    async def close(cls):
+        """Closes every pooled connection of the async engine"""
+        if cls.engine is not None:
+            await cls.engine.dispose()
+            cls.engine = None
+
+    @classmethod
+    def after_fork(cls):
+        """Drops an engine inherited from the parent, whose connections belong to its event loop"""
+        if cls.engine is not None:
+            cls.engine.sync_engine.dispose(close=False)
+            cls.engine = None
+
+    @classmethod
+    async def find_row(cls, id: int):
+        """Finds a Recommendation by its id as a plain row, see Recommendation.find_row()"""
+        async def load():
+            async with cls.engine.connect() as conn:
+                return (await conn.execute(ROW_BY_ID, {"id": id})).first()
+
+        return await read_flights.do_async(("row", id), load)
+
+    @classmethod
+    async def find_rows_page(cls, limit: int, after: int = None, **filters) -> tuple:
+        """Returns one page of plain rows, see Recommendation.find_rows_page()"""
+        query = Recommendation._row_select(filters)
+        if after is not None:
+            query = query.where(Recommendation.__table__.c.id > after)
+        async def load():
+            async with cls.engine.connect() as conn:
+                return (await conn.execute(query.limit(limit + 1))).fetchall()
+
+        rows = await read_flights.do_async(("page", limit, after, repr(sorted(filters.items()))), load)
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    @classmethod
+    async def find_top_rows(cls, top: int, **filters) -> list:
+        """Returns the highest scored plain rows, see Recommendation.find_top_rows()"""
+        query = Recommendation._top_select(filters).limit(top)
+        async def load():
+            async with cls.engine.connect() as conn:
+                return (await conn.execute(query)).fetchall()
+
+        return await read_flights.do_async(("top", top, repr(sorted(filters.items()))), load)
+
+    @classmethod
+    async def find_top_by_src_id_cached(cls, source_id: int, top: int) -> list:
+        """Returns the top serialized Recommendations of a source, see Recommendation.find_top_by_src_id_cached()"""
+        cached = src_cache.get(source_id) if src_cache.enabled else None
+        if cached is not None:
+            return Recommendation.rank(cached, top)
+        return [dict(row._mapping) for row in await cls.find_top_rows(top, src_product_id=source_id)]
+
+    @classmethod
+    async def find_by_src_id_cached(cls, source_id: int) -> list:
+        """Returns serialized Recommendations by source product id through the read-through cache"""
+        results = src_cache.get(source_id) if src_cache.enabled else None
+        if results is None:
+            generation = src_cache.generation(source_id)
+
+            async def load():
+                async with cls.engine.connect() as conn:
+                    return [dict(row._mapping) for row in await conn.execute(ROWS_BY_SOURCE, {"source_id": source_id})]
+
+            results = await read_flights.do_async(("source", source_id), load)
+            src_cache.put(source_id, results, generation)
+        return results
@@ -0,0 +1,26 @@
+"""
+Database maintenance commands
+
+Run them with the Flask CLI, e.g. ``flask create-indexes``
+"""
+import click
+from service import app
+from service.models import Recommendation
+
+
+@app.cli.command("create-indexes")
+def create_indexes():
+    """Creates missing Recommendation indexes without locking the table"""
+    Recommendation.create_indexes()
+    app.logger.info("Recommendation indexes are in place")
+
+
+@app.cli.command("export-graph")
+@click.argument("path", required=False)
+def export_graph(path):
+    """Writes the recommendation graph to a memory-mapped graph file"""
+    path = path or app.config.get("ADJACENCY_GRAPH_FILE")
+    if not path:
+        raise click.UsageError("Give a PATH or set ADJACENCY_GRAPH_FILE")
+    count = Recommendation.export_graph(path)
+    app.logger.info("Exported %d recommendations to %s", count, path)
@@ -3,16 +3,90 @@ Models for Recommendations
 
 All of the models are stored in this module
 """
+import os
+import math
+import heapq
+import hashlib
 import logging
 from enum import Enum
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, desc, event, inspect, select, text, type_coerce
+from sqlalchemy import Enum as SQLEnum
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
 from flask import Flask
+from service.utils.adjacency import AdjacencyIndex, AdjacencySnapshot
+from service.utils.cache import LRUCache
+from service.utils.graphfile import GraphFile, write_graph_file
+from service.utils.groupcommit import GroupCommit
+from service.utils.pool import PoolMonitor
+from service.utils.singleflight import SingleFlight
+from service.utils.slowlog import SlowQueryLog
+from service.utils.versions import VersionTags
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Read-through cache of serialized Recommendations keyed by source product id
+# (sized from the app config in init_db())
+src_cache = LRUCache()
+
+# Optional in-memory snapshot of the whole table, started by init_db()
+src_snapshot = AdjacencySnapshot()
+
+# ETags of source product lookups (sized like src_cache in init_db())
+src_versions = VersionTags()
+
+# Counters of the connection pool, attached to the engine by init_db()
+pool_monitor = PoolMonitor()
+
+# Log of slow SQL statements, configured and attached by init_db()
+slow_query_log = SlowQueryLog()
+
+# Concurrent identical reads share one query (switched on or off by init_db())
+read_flights = SingleFlight()
+
+# Optional writer that commits the creates of concurrent requests together,
+# configured by init_db()
+group_commit = GroupCommit()
+
+# Fingerprint of the schema that was last created, checked on a fast start
+# instead of running db.create_all() (see Recommendation.ensure_schema())
+schema_version = db.Table("schema_version", db.Column("version", db.String(40), primary_key=True))
+
+# Source products that were written, with the id of the last transaction that
+# wrote them, logged by triggers on PostgreSQL so that a graph file can be
+# brought up to date (see Recommendation.track_changes())
+source_changes = db.Table(
+    "recommendation_change",
+    db.Column("src_product_id", db.Integer, primary_key=True, autoincrement=False),
+    db.Column("txid", db.BigInteger, nullable=False),
+)
+
+# Statement level triggers of the change log: name, transition tables and the
+# query of the source products that the statement wrote
+CHANGE_TRIGGERS = {
+    "INSERT": ("recommendation_insert_change", "NEW TABLE AS new_rows", "SELECT src_product_id FROM new_rows"),
+    "UPDATE": (
+        "recommendation_update_change",
+        "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        "SELECT src_product_id FROM old_rows UNION SELECT src_product_id FROM new_rows",
+    ),
+    "DELETE": ("recommendation_delete_change", "OLD TABLE AS old_rows", "SELECT src_product_id FROM old_rows"),
+}
+
+
+def invalidate_sources(*source_ids):
+    """Drops the cached lookups of source products that were written"""
+    # forget the reads in flight first, so that a lookup which reads the
+    # cache generation after the bump below cannot join a read from before it
+    read_flights.forget()
+    src_cache.invalidate(*source_ids)
+    src_snapshot.invalidate(*source_ids)
+    src_versions.bump(*source_ids)
+
 
 class DatabaseConnectionError(Exception):
     """Custom Exception when database connection fails"""
@@ -35,6 +109,19 @@ class Status(Enum):
     DISABLED = 0
     ENABLED = 1
 
+# Enum names by value for serializing rows without building enum members
+TYPE_NAMES = {member.value: member.name for member in Type}
+STATUS_NAMES = {member.value: member.name for member in Status}
+
+# JSON of an (id, src_product_id, rec_product_id, type, status, score) row holding enum names
+ROW_JSON = '{"id":%d,"src_product_id":%d,"rec_product_id":%d,"type":"%s","status":"%s","score":%r}'
+
+# Score of Recommendations created without one
+DEFAULT_SCORE = 0.0
+
+# Range of the integer columns
+INTEGER_MIN, INTEGER_MAX = -2 ** 31, 2 ** 31 - 1
+
 class Recommendation(db.Model):
     """
     Class that represents a Recommendation
@@ -42,6 +129,14 @@ class Recommendation(db.Model):
 
     app = None
 
+    # Secondary indexes for the find_by_* lookups
+    __table_args__ = (
+        db.Index("ix_recommendation_src_status_type", "src_product_id", "status", "type"),
+        db.Index("ix_recommendation_rec_product_id", "rec_product_id"),
+        # serves the top-K lookups of a source product in score order without sorting
+        db.Index("ix_recommendation_src_score", "src_product_id", desc("score"), "id"),
+    )
+
     # Table Schema
     id = db.Column(db.Integer, primary_key=True) # recommendation id
     src_product_id = db.Column(db.Integer, nullable=False) # source product id
@@ -52,10 +147,13 @@ class Recommendation(db.Model):
     status = db.Column( # recommendation type
         db.Enum(Status), nullable=False, server_default=(Status.ENABLED.name)
     )
+    score = db.Column( # ranking weight, higher is better
+        db.Float, nullable=False, default=DEFAULT_SCORE, server_default=str(DEFAULT_SCORE)
+    )
 
     def __repr__(self):
-        return "<Recommendation id=[%s], src_product_id=[%s], rec_product_id=[%s], type=[%s], status=[%s]>" % \
-            (self.id, self.src_product_id, self.rec_product_id, self.type.name, self.status.name)
+        return "<Recommendation id=[%s], src_product_id=[%s], rec_product_id=[%s], type=[%s], status=[%s], score=[%s]>" % \
+            (self.id, self.src_product_id, self.rec_product_id, self.type.name, self.status.name, self.score)
 
     def create(self):
         """
@@ -65,6 +163,24 @@ class Recommendation(db.Model):
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
         db.session.commit()
+        invalidate_sources(self.src_product_id)
+
+    def create_grouped(self):
+        """
+        Creates a Recommendation in a transaction shared with concurrent creates
+
+        The row is written by the group commit writer, which gives the
+        Recommendation its new id but does not add it to the session. Falls
+        back to create() when group commit is off.
+        """
+        if not group_commit.enabled:
+            self.create()
+            return
+        self.id = None
+        if self.score is None:
+            self.score = DEFAULT_SCORE
+        self.id = group_commit.submit(self.column_values())
+        invalidate_sources(self.src_product_id)
 
     def update(self):
         """
@@ -73,15 +189,216 @@ class Recommendation(db.Model):
         logger.info("Saving %s", self.id)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
+        src_ids = self._src_ids()
         db.session.commit()
+        invalidate_sources(*src_ids)
 
     def delete(self):
         """
         Removes a Recommendation from the database
         """
         logger.info("Deleting %s", self.id)
+        src_ids = self._src_ids()
         db.session.delete(self)
         db.session.commit()
+        invalidate_sources(*src_ids)
+
+    @classmethod
+    def bulk_create(cls, recommendations: list, batch_size: int = 1000) -> list:
+        """
+        Creates many Recommendations in a single transaction
+
+        Rows are written with multi-row INSERT ... RETURNING statements of up
+        to batch_size rows each, and every Recommendation is given its new id.
+        Each statement runs in a savepoint, and when it fails its rows are
+        inserted again one by one, each in its own savepoint, so that a bad
+        row only fails itself, like in insert_rows()
+
+        :param recommendations: the Recommendations to create
+        :type recommendations: list
+        :return: the new id of each Recommendation in the same order, or the
+            error of one that could not be written
+        :rtype: list
+        """
+        logger.info("Bulk creating %d Recommendations", len(recommendations))
+        insert = cls.__table__.insert().returning(cls.__table__.c.id)
+        results = []
+        for recommendation in recommendations:
+            if recommendation.score is None:
+                recommendation.score = DEFAULT_SCORE
+        try:
+            for start in range(0, len(recommendations), batch_size):
+                rows = [rec.column_values() for rec in recommendations[start:start + batch_size]]
+                try:
+                    with db.session.begin_nested():
+                        results.extend(row.id for row in db.session.execute(insert.values(rows)))
+                except DBAPIError:
+                    for row in rows:
+                        try:
+                            with db.session.begin_nested():
+                                results.append(db.session.execute(insert.values(row)).scalar_one())
+                        except DBAPIError as error:
+                            results.append(error)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        created = set()
+        for recommendation, result in zip(recommendations, results):
+            if isinstance(result, DBAPIError):
+                recommendation.id = None
+            else:
+                recommendation.id = result
+                created.add(recommendation.src_product_id)
+        invalidate_sources(*created)
+        return results
+
+    @classmethod
+    def insert_rows(cls, engine, rows: list) -> list:
+        """
+        Inserts rows for the group commit writer in one transaction
+
+        All rows go into one multi-row INSERT ... RETURNING. When that fails,
+        they are inserted again one by one, each in its own savepoint, so
+        that a bad row only fails itself
+
+        :param engine: the engine to write with
+        :param rows: the column_values() of new Recommendations
+        :type rows: list
+        :return: the new id of each row, or the error of a row that failed
+        :rtype: list
+        """
+        insert = cls.__table__.insert().returning(cls.__table__.c.id)
+        try:
+            with engine.begin() as conn:
+                return [row.id for row in conn.execute(insert.values(rows))]
+        except DBAPIError as error:
+            if len(rows) == 1:
+                return [error]
+        results = []
+        with engine.begin() as conn:
+            for row in rows:
+                try:
+                    with conn.begin_nested():
+                        results.append(conn.execute(insert.values(row)).scalar_one())
+                except DBAPIError as error:
+                    results.append(error)
+        return results
+
+    @classmethod
+    def update_by_id(cls, id: int, **values):
+        """
+        Updates a Recommendation with a single UPDATE ... RETURNING statement
+
+        The row is neither loaded nor hydrated into a Recommendation first
+
+        :param id: the id of the Recommendation to update
+        :type id: int
+        :param values: the new column values
+        :return: the updated Recommendation serialized, or None if not found
+        :rtype: dict
+        """
+        logger.info("Updating %s in place", id)
+        table = cls.__table__
+        # the old source product id comes back too so its cache entry can go
+        old = (
+            select(table.c.id, table.c.src_product_id.label("old_src_product_id"))
+            .where(table.c.id == id)
+            .with_for_update()
+            .subquery("old")
+        )
+        row = db.session.execute(
+            table.update()
+            .where(table.c.id == old.c.id)
+            .values(**values)
+            .returning(*table.c, old.c.old_src_product_id)
+        ).first()
+        db.session.commit()
+        if row is None:
+            return None
+        invalidate_sources(row.src_product_id, row.old_src_product_id)
+        return cls.serialize_row(row)
+
+    @classmethod
+    def delete_by_id(cls, id: int) -> bool:
+        """
+        Deletes a Recommendation with a single DELETE statement
+
+        :param id: the id of the Recommendation to delete
+        :type id: int
+        :return: True if a Recommendation was deleted
+        :rtype: bool
+        """
+        logger.info("Deleting %s in place", id)
+        table = cls.__table__
+        row = db.session.execute(
+            table.delete().where(table.c.id == id).returning(table.c.src_product_id)
+        ).first()
+        db.session.commit()
+        if row is None:
+            return False
+        invalidate_sources(row.src_product_id)
+        return True
+
+    @classmethod
+    def delete_by_filters(cls, **filters) -> int:
+        """
+        Deletes every Recommendation matching the filters in one statement
+
+        :param filters: any find_by_filters() filters
+        :return: the number of Recommendations deleted
+        :rtype: int
+        """
+        logger.info("Deleting Recommendations matching %s", filters)
+        table = cls.__table__
+        return cls._execute_filtered(table.delete(), filters)
+
+    @classmethod
+    def update_by_filters(cls, values: dict, **filters) -> int:
+        """
+        Updates every Recommendation matching the filters in one statement
+
+        :param values: the new column values
+        :type values: dict
+        :param filters: any find_by_filters() filters
+        :return: the number of Recommendations updated
+        :rtype: int
+        """
+        logger.info("Updating Recommendations matching %s", filters)
+        table = cls.__table__
+        return cls._execute_filtered(table.update().values(**values), filters)
+
+    @classmethod
+    def _execute_filtered(cls, statement, filters: dict) -> int:
+        """Runs a filtered UPDATE or DELETE and invalidates the rows it touched"""
+        whereclause = cls.filter_clause(**filters)
+        if whereclause is not None:
+            statement = statement.where(whereclause)
+        rows = db.session.execute(statement.returning(cls.__table__.c.src_product_id)).fetchall()
+        db.session.commit()
+        invalidate_sources(*{row.src_product_id for row in rows})
+        return len(rows)
+
+    def column_values(self) -> dict:
+        """Returns the column values of a Recommendation without its id
+
+        The score is left out when it was not given, so that an update keeps
+        the current one
+        """
+        values = {
+            "src_product_id": self.src_product_id,
+            "rec_product_id": self.rec_product_id,
+            "type": self.type,
+            "status": self.status,
+        }
+        if self.score is not None:
+            values["score"] = self.score
+        return values
+
+    def _src_ids(self) -> set:
+        """Returns the old and new source product ids of pending changes"""
+        history = db.inspect(self).attrs.src_product_id.history
+        return set(history.added) | set(history.unchanged) | set(history.deleted)
 
     def serialize(self) -> dict:
         """Serializes a Recommendation into a dictionary"""
@@ -91,8 +408,39 @@ class Recommendation(db.Model):
             "rec_product_id": self.rec_product_id,
             "type": self.type.name, # convert enum to string
             "status": self.status.name, # convert enum to string
+            "score": self.score,
+        }
+
+    @staticmethod
+    def serialize_row(row) -> dict:
+        """Serializes a row of Recommendation columns into a dictionary"""
+        return {
+            "id": row.id,
+            "src_product_id": row.src_product_id,
+            "rec_product_id": row.rec_product_id,
+            "type": row.type.name,
+            "status": row.status.name,
+            "score": row.score,
+        }
+
+    @staticmethod
+    def serialize_tuple(row: tuple) -> dict:
+        """Serializes an (id, src_product_id, rec_product_id, type, status, score)
+        tuple with enum values into a dictionary"""
+        return {
+            "id": row[0],
+            "src_product_id": row[1],
+            "rec_product_id": row[2],
+            "type": TYPE_NAMES[row[3]],
+            "status": STATUS_NAMES[row[4]],
+            "score": row[5],
         }
 
+    @staticmethod
+    def serialize_rows_json(rows) -> list:
+        """Serializes rows from find_rows_page() or stream_rows() into JSON strings"""
+        return [ROW_JSON % tuple(row) for row in rows]
+
     def deserialize(self, data: dict):
         """
         Deserializes a Recommendation from a dictionary
@@ -100,22 +448,12 @@ class Recommendation(db.Model):
             data (dict): A dictionary containing the Recommendation data
         """
         try:
-            if isinstance(data["src_product_id"], int):
-                self.src_product_id = data["src_product_id"]
-            else:
-                raise DataValidationError(
-                    "Invalid type for int [src_product_id]: "
-                    + str(type(data["src_product_id"]))
-                )
-            if isinstance(data["rec_product_id"], int):
-                self.rec_product_id = data["rec_product_id"]
-            else:
-                raise DataValidationError(
-                    "Invalid type for int [rec_product_id]: "
-                    + str(type(data["rec_product_id"]))
-                )
+            self.src_product_id = self.valid_id("src_product_id", data["src_product_id"])
+            self.rec_product_id = self.valid_id("rec_product_id", data["rec_product_id"])
             self.type = getattr(Type, data["type"])  # create enum from string
             self.status = getattr(Status, data["status"])  # create enum from string
+            if "score" in data:
+                self.score = self.valid_score(data["score"])
         except AttributeError as error:
             raise DataValidationError("Invalid attribute: " + error.args[0])
         except KeyError as error:
@@ -126,12 +464,151 @@ class Recommendation(db.Model):
             )
         return self
 
+    @staticmethod
+    def valid_id(name: str, value) -> int:
+        """Returns a product id, raising DataValidationError unless it fits an integer column"""
+        if not isinstance(value, int):
+            raise DataValidationError("Invalid type for int [{}]: {}".format(name, type(value)))
+        if not INTEGER_MIN <= value <= INTEGER_MAX:
+            raise DataValidationError("Invalid value for int [{}]: {} is out of range".format(name, value))
+        return value
+
+    @staticmethod
+    def valid_score(score) -> float:
+        """Returns a score as a float, raising DataValidationError unless it is a finite number"""
+        if isinstance(score, bool) or not isinstance(score, (int, float)) or not math.isfinite(score):
+            raise DataValidationError("Invalid score: must be a finite number, got " + repr(score))
+        return float(score)
+
     @classmethod
     def all(cls) -> list:
         """ Returns all of the Products in the database """
         logger.info("Processing all Products")
         return cls.query.all()
 
+    @classmethod
+    def find_page(cls, query, limit: int, after: int = None) -> tuple:
+        """Returns one page of a query using keyset pagination on the id
+
+        :param query: the query to paginate
+        :param limit: the maximum number of Recommendations to return
+        :type limit: int
+        :param after: only return Recommendations with a greater id
+        :type after: int
+        :return: the page of Recommendations and the cursor of the next page,
+            or None when this is the last page
+        :rtype: tuple
+        """
+        if after is not None:
+            query = query.filter(cls.id > after)
+        recommendations = query.order_by(cls.id).limit(limit + 1).all()
+        next_cursor = recommendations[limit - 1].id if len(recommendations) > limit else None
+        return recommendations[:limit], next_cursor
+
+    @classmethod
+    def find_row(cls, id: int):
+        """Finds a Recommendation by its id as a plain row
+
+        :param id: the id of the Recommendation to find
+        :type id: int
+        :return: an (id, src_product_id, rec_product_id, type, status, score) row
+            with enum names, or None if not found
+        """
+        logger.info("Processing row lookup for id %s ...", id)
+        query = cls._row_select({}).where(cls.__table__.c.id == id)
+        return read_flights.do(("row", id), lambda: db.session.execute(query).first())
+
+    @classmethod
+    def find_rows_page(cls, limit: int, after: int = None, **filters) -> tuple:
+        """Returns one page of Recommendations as plain rows using keyset pagination
+
+        Only the serialized columns are selected and no Recommendation is
+        built, so this is much cheaper than find_page() for large pages
+
+        :param limit: the maximum number of rows to return
+        :type limit: int
+        :param after: only return rows with a greater id
+        :type after: int
+        :param filters: any find_by_filters() filters
+        :return: the page of (id, src_product_id, rec_product_id, type, status, score)
+            rows with enum names, and the cursor of the next page or None
+        :rtype: tuple
+        """
+        query = cls._row_select(filters)
+        if after is not None:
+            query = query.where(cls.__table__.c.id > after)
+        rows = read_flights.do(
+            ("page", limit, after, repr(sorted(filters.items()))),
+            lambda: db.session.execute(query.limit(limit + 1)).fetchall(),
+        )
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    @classmethod
+    def find_top_rows(cls, top: int, **filters) -> list:
+        """Returns the highest scored Recommendations as plain rows
+
+        With a single source product the (src_product_id, score) index is
+        walked in order and the query stops after top rows
+
+        :param top: the number of rows to return
+        :type top: int
+        :param filters: any find_by_filters() filters
+        :return: up to top (id, src_product_id, rec_product_id, type, status, score)
+            rows with enum names, highest score first and ties in id order
+        :rtype: list
+        """
+        query = cls._top_select(filters).limit(top)
+        return read_flights.do(
+            ("top", top, repr(sorted(filters.items()))),
+            lambda: db.session.execute(query).fetchall(),
+        )
+
+    @classmethod
+    def _top_select(cls, filters: dict):
+        """Returns a SELECT of the serialized columns of matching Recommendations in score order"""
+        table = cls.__table__
+        return cls._row_select(filters).order_by(None).order_by(table.c.score.desc(), table.c.id)
+
+    @staticmethod
+    def rank(recommendations: list, top: int) -> list:
+        """Returns the top serialized Recommendations, highest score first and ties in id order"""
+        return heapq.nsmallest(top, recommendations, key=lambda rec: (-rec["score"], rec["id"]))
+
+    @classmethod
+    def stream_rows(cls, batch_size: int = 1000, **filters):
+        """Iterates over matching Recommendations as plain rows using a server side cursor
+
+        :param batch_size: the number of rows fetched per round trip
+        :type batch_size: int
+        :param filters: any find_by_filters() filters
+        :return: a generator of lists of up to batch_size rows in id order
+        """
+        logger.info("Streaming Recommendations in batches of %d", batch_size)
+        result = db.session.execute(
+            cls._row_select(filters), execution_options={"stream_results": True}
+        )
+        for rows in result.partitions(batch_size):
+            yield rows
+
+    @classmethod
+    def _row_select(cls, filters: dict):
+        """Returns a SELECT of the serialized columns of matching Recommendations"""
+        table = cls.__table__
+        query = select(
+            table.c.id,
+            table.c.src_product_id,
+            table.c.rec_product_id,
+            # read the enum names as plain strings instead of building enum members
+            type_coerce(table.c.type, db.String),
+            type_coerce(table.c.status, db.String),
+            table.c.score,
+        )
+        whereclause = cls.filter_clause(**filters)
+        if whereclause is not None:
+            query = query.where(whereclause)
+        return query.order_by(table.c.id)
+
     @classmethod
     def find(cls, id: int):
         """Finds a Recommendation by it's ID
@@ -174,7 +651,148 @@ class Recommendation(db.Model):
         :rtype: list
         """
         return cls.query.filter(cls.src_product_id == source_id)
+
+    @classmethod
+    def find_by_src_id_cached(cls, source_id: int) -> list:
+        """Returns serialized Recommendations by source product id
+
+        Results are served from the read-through cache when possible and
+        loaded with find_by_src_id() on a miss
+
+        :param source_id: the id of the source product to find
+        :type source_id: int
+        :return: list of serialized Recommendations
+        :rtype: list
+        """
+        if src_snapshot.enabled:
+            return [cls.serialize_tuple(row) for row in src_snapshot.lookup(source_id)]
+        return src_cache.get_or_load(
+            source_id,
+            lambda: read_flights.do(
+                ("source", source_id),
+                lambda: [rec.serialize() for rec in cls.find_by_src_id(source_id).order_by(cls.id)],
+            ),
+        )
     
+    @classmethod
+    def find_top_by_src_id_cached(cls, source_id: int, top: int) -> list:
+        """Returns the top serialized Recommendations of a source product
+
+        They are ranked from the snapshot or the read-through cache when the
+        source is held there, and read with find_top_rows() otherwise, so a
+        miss does not load every Recommendation of the source
+
+        :param source_id: the id of the source product to find
+        :type source_id: int
+        :param top: the number of Recommendations to return
+        :type top: int
+        :return: list of serialized Recommendations, highest score first
+        :rtype: list
+        """
+        if src_snapshot.enabled:
+            return cls.rank(cls.find_by_src_id_cached(source_id), top)
+        cached = src_cache.get(source_id)
+        if cached is not None:
+            return cls.rank(cached, top)
+        return [dict(row._mapping) for row in cls.find_top_rows(top, src_product_id=source_id)]
+
+    @classmethod
+    def find_by_src_ids(cls, source_ids: list):
+        """Returns all Recommendations for several source product ids
+        :param source_ids: the ids of the source products to find
+        :type source_ids: list
+        :return: list of Recommendations
+        :rtype: list
+        """
+        return cls.query.filter(cls.src_product_id.in_(source_ids))
+
+    @classmethod
+    def find_by_filters(cls, src_product_id=None, rec_product_id: int = None, type=None, status=None):
+        """Returns all Recommendations matching every given filter
+
+        :param src_product_id: a source product id or a list of them
+        :param rec_product_id: the id of the recommended product
+        :type rec_product_id: int
+        :param type: a Type or the name of one
+        :param status: a Status or the name of one
+        :return: a query combining the filters
+        """
+        clause = cls.filter_clause(src_product_id, rec_product_id, type, status)
+        return cls.query.filter(clause) if clause is not None else cls.query
+
+    @classmethod
+    def filter_clause(cls, src_product_id=None, rec_product_id: int = None, type=None, status=None):
+        """Returns the WHERE clause of find_by_filters(), or None without filters
+
+        The clause needs no session, so it can be used in Core statements
+        """
+        clauses = []
+        if isinstance(src_product_id, (list, tuple, set)):
+            clauses.append(cls.src_product_id.in_(src_product_id))
+        elif src_product_id is not None:
+            clauses.append(cls.src_product_id == src_product_id)
+        if rec_product_id is not None:
+            clauses.append(cls.rec_product_id == rec_product_id)
+        if type is not None:
+            clauses.append(cls.type == cls._enum_value(Type, type))
+        if status is not None:
+            clauses.append(cls.status == cls._enum_value(Status, status))
+        return and_(*clauses) if clauses else None
+
+    @classmethod
+    def find_grouped_by_src(cls, src_product_id: list, **filters) -> dict:
+        """Returns serialized Recommendations grouped by source product id
+
+        :param src_product_id: the ids of the source products to find
+        :type src_product_id: list
+        :param filters: any other find_by_filters() filters
+        :return: lists of serialized Recommendations keyed by source product id
+        :rtype: dict
+        """
+        if not filters:
+            return cls.find_by_src_ids_cached(src_product_id)
+        results = {source_id: [] for source_id in src_product_id}
+        for rec in cls.find_by_filters(src_product_id, **filters).order_by(cls.id):
+            results[rec.src_product_id].append(rec.serialize())
+        return results
+
+    @staticmethod
+    def _enum_value(enum, value):
+        """Returns the member of enum for a member or its name"""
+        if isinstance(value, enum):
+            return value
+        try:
+            return enum[value]
+        except KeyError:
+            raise DataValidationError("Invalid {}: {}".format(enum.__name__.lower(), value))
+
+    @classmethod
+    def find_by_src_ids_cached(cls, source_ids: list) -> dict:
+        """Returns serialized Recommendations grouped by source product id
+
+        Source products found in the read-through cache are served from it and
+        all of the others are loaded with a single find_by_src_ids() query
+
+        :param source_ids: the ids of the source products to find
+        :type source_ids: list
+        :return: lists of serialized Recommendations keyed by source product id
+        :rtype: dict
+        """
+        if src_snapshot.enabled:
+            return {source_id: cls.find_by_src_id_cached(source_id) for source_id in source_ids}
+        results = {source_id: src_cache.get(source_id) for source_id in source_ids}
+        missing = [source_id for source_id, value in results.items() if value is None]
+        generations = {source_id: src_cache.generation(source_id) for source_id in missing}
+        if missing:
+            logger.info("Processing lookup for source ids %s ...", missing)
+            for source_id in missing:
+                results[source_id] = []
+            for rec in cls.find_by_src_ids(missing).order_by(cls.id):
+                results[rec.src_product_id].append(rec.serialize())
+            for source_id in missing:
+                src_cache.put(source_id, results[source_id], generations[source_id])
+        return results
+
     @classmethod
     def find_by_rec_id(cls, rec_id : int):
         """Returns all Recommendations by recommendation product id
@@ -185,6 +803,196 @@ class Recommendation(db.Model):
         """
         return cls.query.filter(cls.rec_product_id == rec_id)
 
+    @classmethod
+    def create_indexes(cls):
+        """Creates any missing indexes on an existing Recommendation table
+
+        On PostgreSQL the indexes are built with CREATE INDEX CONCURRENTLY so
+        that reads and writes are not locked out while a large table is
+        indexed. An index left invalid by an interrupted build is rebuilt.
+        """
+        engine = db.engine
+        if engine.dialect.name != "postgresql":
+            for index in cls.__table__.indexes:
+                index.create(bind=engine, checkfirst=True)
+            return
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            for index in cls.__table__.indexes:
+                valid = conn.execute(
+                    text(
+                        "SELECT i.indisvalid FROM pg_index i "
+                        "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+                    ),
+                    {"name": index.name},
+                ).scalar()
+                if valid:
+                    continue
+                if valid is False:
+                    logger.warning("Dropping invalid index %s", index.name)
+                    conn.execute(text('DROP INDEX CONCURRENTLY IF EXISTS "{}"'.format(index.name)))
+                logger.info("Creating index %s", index.name)
+                ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+                conn.execute(text(ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)))
+
+    @classmethod
+    def snapshot_rows(cls, conn, source_id: int = None):
+        """Returns (id, src_product_id, rec_product_id, type, status, score) rows for a snapshot
+
+        :param conn: the connection to read with
+        :param source_id: only return the rows of this source product
+        :type source_id: int
+        :return: rows sorted by source product id and id, with enum values
+        """
+        table = cls.__table__
+        query = select(
+            table.c.id, table.c.src_product_id, table.c.rec_product_id, table.c.type, table.c.status, table.c.score
+        )
+        if source_id is not None:
+            query = query.where(table.c.src_product_id == source_id)
+        result = conn.execution_options(stream_results=True).execute(
+            query.order_by(table.c.src_product_id, table.c.id)
+        )
+        for row in result:
+            yield (row.id, row.src_product_id, row.rec_product_id, row.type.value, row.status.value, row.score)
+
+    @classmethod
+    def export_graph(cls, path: str) -> int:
+        """Writes the whole table to a memory-mapped graph file
+
+        The change watermark is taken before the rows are read and stored in
+        the file, so that readers reload the source products written since
+        :param path: where to write the file
+        :type path: str
+        :return: the number of Recommendations written
+        :rtype: int
+        """
+        logger.info("Exporting recommendation graph to %s", path)
+        with db.engine.connect() as conn:
+            watermark = cls.change_watermark(conn)
+            return write_graph_file(path, cls.snapshot_rows(conn), watermark)
+
+    @classmethod
+    def change_watermark(cls, conn) -> int:
+        """Returns the oldest transaction id that a query started now might not see
+
+        Every transaction with a lower id has ended, so its writes are in the
+        recommendation_change log and in the rows read from now on
+        :param conn: the connection to read with
+        :return: the transaction id, or 0 when changes are not tracked
+        :rtype: int
+        """
+        if conn.dialect.name != "postgresql":
+            return 0
+        return conn.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())")).scalar()
+
+    @classmethod
+    def sources_changed_since(cls, conn, watermark: int) -> tuple:
+        """Returns the source products written since a change watermark
+
+        :param conn: the connection to read with
+        :param watermark: a change_watermark()
+        :type watermark: int
+        :return: the source product ids and the watermark to ask with next
+        :rtype: tuple
+        """
+        next_watermark = cls.change_watermark(conn)
+        query = select(source_changes.c.src_product_id).where(source_changes.c.txid >= watermark)
+        return [row.src_product_id for row in conn.execute(query)], next_watermark
+
+    @classmethod
+    def track_changes(cls, conn=None):
+        """Installs the triggers that log the written source products in recommendation_change
+
+        The triggers fire once per statement, whoever writes the table, and
+        record the source products with the id of the writing transaction.
+        Only PostgreSQL is supported. New tables get the triggers when they are
+        created, existing ones when they lack any of them.
+        :param conn: the connection to install them with, in its transaction
+        """
+        if conn is None:
+            with db.engine.begin() as conn:
+                cls.track_changes(conn)
+            return
+        if conn.dialect.name != "postgresql":
+            return
+        table = cls.__table__.name
+        # instances that start at the same time install the triggers one by one
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('recommendation_change'))"))
+        installed = {
+            row.tgname for row in conn.execute(
+                text("SELECT tgname FROM pg_trigger WHERE tgrelid = CAST(:table AS regclass)"), {"table": table}
+            )
+        }
+        missing = [(event_name, trigger) for event_name, trigger in CHANGE_TRIGGERS.items() if trigger[0] not in installed]
+        if not missing:
+            return
+        logger.info("Installing the change log triggers of %s", table)
+        branches = " ELSIF ".join(
+            "TG_OP = '{}' THEN INSERT INTO {} (src_product_id, txid) "
+            "SELECT DISTINCT src_product_id, txid_current() FROM ({}) AS written ORDER BY 1 "
+            "ON CONFLICT (src_product_id) DO UPDATE SET txid = EXCLUDED.txid "
+            "WHERE {}.txid <> EXCLUDED.txid;".format(event_name, source_changes.name, query, source_changes.name)
+            for event_name, (_, _, query) in CHANGE_TRIGGERS.items()
+        )
+        conn.execute(text(
+            "CREATE OR REPLACE FUNCTION recommendation_log_change() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            "BEGIN IF {} END IF; RETURN NULL; END $$".format(branches)
+        ))
+        for event_name, (name, transition_tables, _) in missing:
+            conn.execute(text(
+                'CREATE TRIGGER {} AFTER {} ON "{}" REFERENCING {} '
+                "FOR EACH STATEMENT EXECUTE FUNCTION recommendation_log_change()".format(
+                    name, event_name, table, transition_tables
+                )
+            ))
+
+    @classmethod
+    def start_snapshot(cls, app: Flask):
+        """Builds the in-memory snapshot and serves source lookups from it
+
+        When ADJACENCY_GRAPH_FILE names an existing graph file it is mapped
+        instead of reading the table, and a new file moved into its place is
+        picked up on the next refresh. The source products written since the
+        file's watermark, by any process, are read from the change log at
+        startup and on every refresh and reloaded from the table. Graph files
+        need PostgreSQL for that, and are ignored on other databases.
+        :param app: the Flask app
+        :type app: Flask
+        """
+
+        graph_path = app.config.get("ADJACENCY_GRAPH_FILE")
+        if graph_path and db.engine.dialect.name != "postgresql":
+            logger.warning("Ignoring ADJACENCY_GRAPH_FILE, changes are only tracked on PostgreSQL")
+            graph_path = None
+        watermarks = {}  # the watermark to read the changes of a graph file from
+
+        def build():
+            if graph_path and os.path.exists(graph_path):
+                current = src_snapshot.index
+                if isinstance(current, GraphFile) and not current.changed():
+                    return current
+                graph = GraphFile(graph_path)
+                watermarks.clear()
+                watermarks[graph] = graph.watermark
+                return graph
+            with app.app_context(), db.engine.connect() as conn:
+                return AdjacencyIndex(cls.snapshot_rows(conn))
+
+        def load_source(source_id):
+            with app.app_context(), db.engine.connect() as conn:
+                return list(cls.snapshot_rows(conn, source_id))
+
+        def changes(index):
+            if index not in watermarks:
+                return ()  # read from the table
+            with app.app_context(), db.engine.connect() as conn:
+                changed, watermarks[index] = cls.sources_changed_since(conn, watermarks[index])
+            return changed
+
+        src_snapshot.start(build, load_source, app.config.get("ADJACENCY_REFRESH_INTERVAL", 60.0), changes)
+        logger.info("Adjacency snapshot built with %d rows", len(src_snapshot.index))
+
     @classmethod
     def init_db(cls, app: Flask):
         """Initializes the database session
@@ -193,6 +1001,127 @@ class Recommendation(db.Model):
         """
         logger.info("Initializing database")
         # This is where we initialize SQLAlchemy from the Flask app
+        engine_options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        engine_options.setdefault("poolclass", pool_monitor.queue_pool_class())
         db.init_app(app)
+        src_cache.configure(
+            app.config.get("RECOMMENDATION_CACHE_SIZE", 1024),
+            app.config.get("RECOMMENDATION_CACHE_TTL", 30.0),
+        )
+        src_versions.configure(
+            app.config.get("RECOMMENDATION_CACHE_SIZE", 1024),
+            app.config.get("RECOMMENDATION_CACHE_TTL", 30.0),
+        )
+        read_flights.configure(app.config.get("SINGLE_FLIGHT", True))
+        group_commit.configure(
+            lambda rows: cls.insert_rows(db.get_engine(app), rows),
+            app.config.get("GROUP_COMMIT_WINDOW_MS", 2.0),
+            app.config.get("GROUP_COMMIT_MAX_ROWS", 100),
+            app.config.get("GROUP_COMMIT", False),
+        )
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        pool_monitor.attach(db.engine)
+        slow_query_log.configure(
+            app.config.get("SLOW_QUERY_MS", 0),
+            app.config.get("SLOW_QUERY_LOG_PARAMS", False),
+            app.config.get("SLOW_QUERY_EXPLAIN", False),
+        )
+        slow_query_log.attach(db.engine)
+        if app.config.get("FAST_START"):
+            cls.ensure_schema()
+        else:
+            db.create_all()  # make our sqlalchemy tables
+            cls.add_missing_columns()
+            cls.track_changes()
+        if app.config.get("ADJACENCY_SNAPSHOT"):
+            cls.start_snapshot(app)
+
+    @classmethod
+    def schema_fingerprint(cls) -> str:
+        """Returns a hash of the tables, indexes and enum types that db.create_all() creates"""
+        dialect = db.engine.dialect
+        ddl = []
+        for table in db.metadata.sorted_tables:
+            ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                ddl.append(str(CreateIndex(index).compile(dialect=dialect)))
+            for column in table.columns:
+                if isinstance(column.type, SQLEnum):
+                    ddl.append("{}: {}".format(column.type.name, ",".join(column.type.enums)))
+        return hashlib.sha1("\n".join(ddl).encode()).hexdigest()
+
+    @classmethod
+    def add_missing_columns(cls):
+        """Adds the columns of the model that an existing Recommendation table lacks
+
+        db.create_all() skips tables that already exist, so a column added to
+        the model after the table was created, like score, is added here with
+        its server default. New indexes are left to create_indexes(). On
+        PostgreSQL the column is added with IF NOT EXISTS, since instances that
+        start at the same time all find it missing and only one can add it.
+        """
+        table = cls.__table__
+        existing = {column["name"] for column in inspect(db.engine).get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if not missing:
+            return
+        add_column = "ADD COLUMN IF NOT EXISTS" if db.engine.dialect.name == "postgresql" else "ADD COLUMN"
+        with db.engine.begin() as conn:
+            for column in missing:
+                logger.info("Adding column %s to %s", column.name, table.name)
+                ddl = str(CreateColumn(column).compile(dialect=conn.dialect))
+                conn.execute(text('ALTER TABLE "{}" {} {}'.format(table.name, add_column, ddl)))
+
+    @classmethod
+    def ensure_schema(cls):
+        """Creates the tables unless the schema version stamp says they are current
+
+        Reading the stamp is a single primary key lookup, where db.create_all()
+        queries the catalog for every table and enum type on each start. The
+        tables are created and stamped when the stamp is missing or was made
+        for another version of the models.
+        """
+        version = cls.schema_fingerprint()
+        try:
+            with db.engine.connect() as conn:
+                current = conn.execute(select(schema_version.c.version)).scalar()
+        except DBAPIError:
+            current = None  # no stamp table yet
+        if current == version:
+            return
+        logger.info("Schema version %s is not stamped, creating tables", version)
+        db.create_all()
+        cls.add_missing_columns()
+        cls.track_changes()
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(schema_version.delete())
+                conn.execute(schema_version.insert().values(version=version))
+        except IntegrityError:
+            pass  # stamped by another process at the same time
+
+    @classmethod
+    def before_fork(cls):
+        """Closes the pooled connections of a process that is about to fork workers
+
+        Workers then open their own connections instead of sharing the sockets
+        of the parent. Everything else built by init_db(), like the snapshot,
+        is inherited as is.
+        """
+        db.engine.dispose()
+
+    @classmethod
+    def after_fork(cls):
+        """Gives a forked worker a new connection pool
+
+        Connections inherited from the parent are dropped without being closed,
+        since closing them would also end the parent's sessions.
+        """
+        db.engine.dispose(close=False)
+        pool_monitor.clear()
+
+
+@event.listens_for(Recommendation.__table__, "after_create")
+def track_changes_of_new_table(target, connection, **kw):  # pylint: disable=unused-argument
+    """Installs the change log triggers on a Recommendation table that was just created"""
+    Recommendation.track_changes(connection)
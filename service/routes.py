@@ -4,12 +4,19 @@ Recommendations Service
 The recommendations resource is a representation a product recommendation based on another product
 """
 
-from flask import jsonify, request, url_for, abort, make_response
-from service.models import Recommendation, Status, Type, DataValidationError, DatabaseConnectionError
+import json
+from urllib.parse import urlencode
+from flask import jsonify, request, url_for, abort, make_response, Response, stream_with_context
+from sqlalchemy.exc import DBAPIError
+from service.models import (
+    Recommendation, Status, Type, DataValidationError, DatabaseConnectionError,
+    src_cache, src_snapshot, src_versions, pool_monitor, read_flights, group_commit,
+)
 from . import app
-from .utils import status
+from .utils import metrics, status
+from .utils.timing import measure
 from werkzeug.exceptions import NotFound
-from flask_restx import Api, Resource, fields, reqparse, inputs
+from flask_restx import Api, Resource, fields, reqparse, inputs, marshal
 
 # Document the type of autorization required
 authorizations = {
@@ -20,6 +27,9 @@ authorizations = {
     }
 }
 
+# Media type of streamed listings (one JSON document per line)
+NDJSON = "application/x-ndjson"
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -51,22 +61,32 @@ create_model = api.model('Recommendation', {
     'rec_product_id': fields.Integer(required=True,
                               description='The target ID of recommendation'),
     'type': fields.String(enum=Type._member_names_, description='The type of the recommendation'),
-    'status': fields.String(enum=Status._member_names_, description='The status of the recommendation')
+    'status': fields.String(enum=Status._member_names_, description='The status of the recommendation'),
+    'score': fields.Float(description='The ranking weight of the recommendation, higher is better')
 })
 
-recommendation_model = api.inherit(
-    'RecommendationModel', 
-    create_model,
-    {
-        '_id': fields.String(readOnly=True,
-                            description='The unique id assigned internally by service'),
-    }
-)
+# Returned Recommendations have the same fields as the ones that are sent
+recommendation_model = api.inherit('RecommendationModel', create_model, {})
+
 
+# The fields mask header honoured by the GET endpoints
+fields_mask_param = {
+    'X-Fields': {'in': 'header', 'type': 'string', 'format': 'mask', 'description': 'An optional fields mask'}
+}
 
 # query string arguments
 recommendation_args = reqparse.RequestParser()
 recommendation_args.add_argument('src_product_id', type=int, required=False, help='List Recommendations by source ID')
+recommendation_args.add_argument('rec_product_id', type=int, required=False,
+                                 help='List Recommendations by recommended product ID')
+recommendation_args.add_argument('type', type=str, required=False, choices=Type._member_names_,
+                                 help='List Recommendations by type')
+recommendation_args.add_argument('status', type=str, required=False, choices=Status._member_names_,
+                                 help='List Recommendations by status')
+recommendation_args.add_argument('limit', type=int, required=False, help='Maximum number of Recommendations to return')
+recommendation_args.add_argument('after', type=int, required=False,
+                                 help='Return Recommendations after this id (next page cursor)')
+recommendation_args.add_argument('top', type=int, required=False, help='Return only the highest scored Recommendations')
 
 
 ######################################################################
@@ -78,27 +98,24 @@ def list_recommendations():
     """Returns all of the recommendation"""
     app.logger.info("Request to list Recommendations...")
 
-    recommendations = []
-    src_product_id = request.args.get("src_product_id")
-    rec_product_id = request.args.get("rec_product_id")
-    type = request.args.get("type")
-
-    if src_product_id:
-        app.logger.info("Find by source product id: %s", src_product_id)
-        recommendations = Recommendation.find_by_src_id(int(src_product_id))
-    elif rec_product_id:
-        app.logger.info("Find by recommendation product id: %s", rec_product_id)
-        recommendations = Recommendation.find_by_rec_id(int(rec_product_id))
-    elif type:
-        app.logger.info("Find by type: %s", type)
-        recommendations = Recommendation.find_by_type(type)
-    else:
-        app.logger.info("Find all")
-        recommendations = Recommendation.all()
+    filters = get_filters(request.args)
+    limit, after = get_page_args(request.args.get("limit"), request.args.get("after"))
+    top = get_top(request.args.get("top"))
+    app.logger.info("Find by filters: %s", filters)
 
-    results = [recommendation.serialize() for recommendation in recommendations]
-    app.logger.info("Returning %d recommendations", len(results))
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    if "," in request.args.get("src_product_id", ""):
+        results = Recommendation.find_grouped_by_src(**filters)
+        if top is not None:
+            results = {source_id: Recommendation.rank(recs, top) for source_id, recs in results.items()}
+        with measure("serialize"):
+            response = make_response(jsonify(results), status.HTTP_200_OK)
+        return conditional_response(response)
+
+    if top is None and stream_requested():
+        app.logger.info("Streaming recommendations")
+        return stream_recommendations(filters)
+
+    return list_response(filters, limit, after, top)
 
 
 ######################################################################
@@ -145,9 +162,9 @@ class RecommendationResource(Resource):
     #------------------------------------------------------------------
     # RETRIEVE A RECOMMENDATION
     #------------------------------------------------------------------
-    @api.doc('get_recommendations')
+    @api.doc('get_recommendations', params=fields_mask_param)
     @api.response(404, 'recommendation not found')
-    @api.marshal_with(recommendation_model)
+    @api.response(200, 'Success', recommendation_model)
     def get(self, recommendation_id):
         """
         Retrieve a single recommendation
@@ -155,10 +172,15 @@ class RecommendationResource(Resource):
         This endpoint will return a Recommendation based on it's id
         """
         app.logger.info("Request to Retrieve a recommendation with id [%s]", recommendation_id)
-        recommendation = Recommendation.find(recommendation_id)
-        if not recommendation:
+        row = Recommendation.find_row(recommendation_id)
+        if not row:
             abort(status.HTTP_404_NOT_FOUND, "Recommendation with id '{}' was not found.".format(recommendation_id))
-        return recommendation.serialize(), status.HTTP_200_OK
+        mask = request.headers.get(app.config["RESTX_MASK_HEADER"])
+        if mask:
+            with measure("serialize"):
+                result = marshal(dict(row._mapping), recommendation_model, mask=mask)
+            return result, status.HTTP_200_OK
+        return row_response(row)
 
     #------------------------------------------------------------------
     # UPDATE AN EXISTING RECOMMENDATION
@@ -175,15 +197,12 @@ class RecommendationResource(Resource):
         This endpoint will update a Recommendation based the body that is posted
         """
         app.logger.info('Request to Update a recommendation with id [%s]', recommendation_id)
-        recommendation = Recommendation.find(recommendation_id)
+        app.logger.debug('Payload = %s', api.payload)
+        data = Recommendation().deserialize(api.payload)
+        recommendation = Recommendation.update_by_id(recommendation_id, **data.column_values())
         if not recommendation:
             abort(status.HTTP_404_NOT_FOUND, "Recommendation with id '{}' was not found.".format(recommendation_id))
-        app.logger.debug('Payload = %s', api.payload)
-        data = api.payload
-        recommendation.deserialize(data)
-        recommendation.id = recommendation_id
-        recommendation.update()
-        return recommendation.serialize(), status.HTTP_200_OK
+        return recommendation, status.HTTP_200_OK
 
     #------------------------------------------------------------------
     # DELETE A RECOMMENDATION
@@ -197,9 +216,7 @@ class RecommendationResource(Resource):
         This endpoint will delete a recommendation based the id specified in the path
         """
         app.logger.info('Request to Delete a Recommendation with id [%s]', recommendation_id)
-        recommendation = Recommendation.find(recommendation_id)
-        if recommendation:
-            recommendation.delete()
+        if Recommendation.delete_by_id(recommendation_id):
             app.logger.info('Recommendation with id [%s] was deleted', recommendation_id)
 
         return '', status.HTTP_204_NO_CONTENT
@@ -213,24 +230,24 @@ class RecommendationCollection(Resource):
     #------------------------------------------------------------------
     # LIST ALL RECOMMENDATIONS
     #------------------------------------------------------------------
-    @api.doc('list_recommendations')
+    @api.doc('list_recommendations', params=fields_mask_param)
     @api.expect(recommendation_args, validate=True)
-    @api.marshal_list_with(recommendation_model)
+    @api.response(200, 'Success', [recommendation_model])
     def get(self):
         """ Returns all of the Recommendations """
         app.logger.info('Request to list Recommendations...')
-        recommendations = []
         args = recommendation_args.parse_args()
-        if args['src_product_id']:
-            app.logger.info('Filtering by Source ID: %s', args['src_product_id'])
-            recommendations = Recommendation.find_by_src_id(int(args['src_product_id']))
-        else:
-            app.logger.info('Returning unfiltered list.')
-            recommendations = Recommendation.all()
-
-        # app.logger.info('[%s] Recommendations returned', len(recommendations))
-        results = [recommendation.serialize() for recommendation in recommendations]
-        return results, status.HTTP_200_OK
+        filters = get_filters(args)
+        limit, after = get_page_args(args['limit'], args['after'])
+        top = get_top(args['top'])
+        app.logger.info('Filtering by: %s', filters)
+        mask = request.headers.get(app.config["RESTX_MASK_HEADER"])
+        if mask:
+            results, next_cursor = list_page(filters, limit, after, top)
+            with measure("serialize"):
+                results = marshal(results, recommendation_model, mask=mask)
+            return results, status.HTTP_200_OK, page_headers(next_cursor, limit)
+        return list_response(filters, limit, after, top)
 
 
     #------------------------------------------------------------------
@@ -249,7 +266,7 @@ class RecommendationCollection(Resource):
         recommendation = Recommendation()
         app.logger.debug('Payload = %s', api.payload)
         recommendation.deserialize(api.payload)
-        recommendation.create()
+        recommendation.create_grouped()
         app.logger.info('Pet with new id [%s] created!', recommendation.id)
         location_url = api.url_for(RecommendationResource, recommendation_id=recommendation.id, _external=True)
         return recommendation.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
@@ -269,12 +286,12 @@ def get_recommendations(id):
     This endpoint will return a Recommendation based on it's id
     """
     app.logger.info("Request for recommendation with id: %s", id)
-    recommendation = Recommendation.find(id)
-    if not recommendation:
+    row = Recommendation.find_row(id)
+    if not row:
         raise NotFound("Recommendation with id '{}' was not found.".format(id))
 
-    app.logger.info("Returning recommendation: %s", recommendation.id)
-    return make_response(jsonify(recommendation.serialize()), status.HTTP_200_OK)
+    app.logger.info("Returning recommendation: %s", id)
+    return row_response(row)
 
 ######################################################################
 # ADD A NEW RECOMMENDATION
@@ -290,7 +307,7 @@ def create_recommendations():
     check_content_type("application/json")
     recommendation = Recommendation()
     recommendation.deserialize(request.get_json())
-    recommendation.create()
+    recommendation.create_grouped()
     message = recommendation.serialize()
     location_url = url_for("get_recommendations", id=recommendation.id, _external=True)
 
@@ -299,6 +316,39 @@ def create_recommendations():
         jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
     )
 
+######################################################################
+# ADD MANY RECOMMENDATIONS
+######################################################################
+
+@app.route("/recommendations/bulk", methods=["POST"])
+def bulk_create_recommendations():
+    """
+    Creates many Recommendations
+    This endpoint takes a JSON array or an NDJSON body, validates every item and
+    creates all of the valid ones in a single transaction
+    """
+    app.logger.info("Request to bulk create Recommendations")
+    check_content_type("application/json", NDJSON)
+    items, errors = read_bulk_items()
+    recommendations, indexes = [], []
+    for index, data in items:
+        try:
+            recommendations.append(Recommendation().deserialize(data))
+            indexes.append(index)
+        except DataValidationError as error:
+            errors.append({"index": index, "message": str(error)})
+    ids = []
+    for index, result in zip(indexes, Recommendation.bulk_create(recommendations)):
+        if isinstance(result, DBAPIError):
+            errors.append({"index": index, "message": "Database error: " + str(result.orig).strip()})
+        else:
+            ids.append(result)
+    errors.sort(key=lambda error: error["index"])
+
+    app.logger.info("Created %d recommendations, rejected %d", len(ids), len(errors))
+    code = status.HTTP_400_BAD_REQUEST if errors and not ids else status.HTTP_201_CREATED
+    return make_response(jsonify(created=ids, errors=errors), code)
+
 ######################################################################
 # UPDATE AN EXISTING RECOMMENDATION
 ######################################################################
@@ -311,15 +361,13 @@ def update_recommendations(item_id):
     """
     app.logger.info("Request to update a recommendation with id: %s", item_id)
     check_content_type("application/json")
-    recommendation = Recommendation.find(item_id)
+    data = Recommendation().deserialize(request.get_json())
+    recommendation = Recommendation.update_by_id(item_id, **data.column_values())
     if not recommendation:
         raise NotFound("recommendation with id '{}' was not found.".format(item_id))
-    recommendation.deserialize(request.get_json())
-    recommendation.id = item_id
-    recommendation.update()
 
-    app.logger.info("recommendation with ID [%s] updated.", recommendation.id)
-    return make_response(jsonify(recommendation.serialize()), status.HTTP_200_OK)
+    app.logger.info("recommendation with ID [%s] updated.", item_id)
+    return make_response(jsonify(recommendation), status.HTTP_200_OK)
 
 ######################################################################
 # DELETE A RECOMMENDATION
@@ -332,13 +380,27 @@ def delete_recommendations(item_id):
     This endpoint will delete a recommendation based the id specified in the path
     """
     app.logger.info("Request to delete recommendation with id: %s", item_id)
-    recommendation = Recommendation.find(item_id)
-    if recommendation:
-        recommendation.delete()
+    Recommendation.delete_by_id(item_id)
 
     app.logger.info("recommendation with ID [%s] delete complete.", item_id)
     return make_response("", status.HTTP_204_NO_CONTENT)
 
+@app.route("/recommendations", methods=["DELETE"])
+def delete_recommendations_by_source():
+    """
+    Delete the recommendations of a source product
+    This endpoint will delete every recommendation matching the query string,
+    which must name at least one src_product_id
+    """
+    filters = get_filters(request.args)
+    app.logger.info("Request to delete recommendations matching: %s", filters)
+    if not filters.get("src_product_id"):
+        raise DataValidationError("Deleting recommendations requires a src_product_id")
+    count = Recommendation.delete_by_filters(**filters)
+
+    app.logger.info("Deleted %d recommendations.", count)
+    return make_response(jsonify(deleted=count), status.HTTP_200_OK)
+
 ######################################################################
 # ACTION: ENABLE AND DISABLE A RECOMMENDATION
 ######################################################################
@@ -350,15 +412,12 @@ def enable_recommendations(id):
     This endpoint will enable a recommendation based on the id specified in the path
     """
     app.logger.info("Request to enable recommendation with id: %s", id)
-    recommendation = Recommendation.find(id)
+    recommendation = Recommendation.update_by_id(id, **get_action_values(Status.ENABLED))
     if not recommendation:
         raise NotFound("recommendation with id '{}' was not found.".format(id))
-    recommendation.deserialize(request.get_json())
-    recommendation.status = Status.ENABLED
-    recommendation.update()
 
-    app.logger.info("recommendation with ID [%s] enabled.", recommendation.id)
-    return make_response(jsonify(recommendation.serialize()), status.HTTP_200_OK)
+    app.logger.info("recommendation with ID [%s] enabled.", id)
+    return make_response(jsonify(recommendation), status.HTTP_200_OK)
 
 @app.route("/recommendations/<int:id>/disable", methods=["PUT"])
 def disable_recommendations(id):
@@ -367,30 +426,314 @@ def disable_recommendations(id):
     This endpoint will disable a recommendation based on the id specified in the path
     """
     app.logger.info("Request to disable recommendation with id: %s", id)
-    recommendation = Recommendation.find(id)
+    recommendation = Recommendation.update_by_id(id, **get_action_values(Status.DISABLED))
     if not recommendation:
         raise NotFound("recommendation with id '{}' was not found.".format(id))
-    recommendation.deserialize(request.get_json())
-    recommendation.status = Status.DISABLED
-    recommendation.update()
 
-    app.logger.info("recommendation with ID [%s] disabled.", recommendation.id)
-    return make_response(jsonify(recommendation.serialize()), status.HTTP_200_OK)
+    app.logger.info("recommendation with ID [%s] disabled.", id)
+    return make_response(jsonify(recommendation), status.HTTP_200_OK)
+
+@app.route("/recommendations/enable", methods=["PUT"])
+def enable_many_recommendations():
+    """
+    Enable many recommendations
+    This endpoint will enable every recommendation matching the query string
+    """
+    app.logger.info("Request to enable recommendations")
+    return set_status_by_filters(Status.ENABLED)
+
+@app.route("/recommendations/disable", methods=["PUT"])
+def disable_many_recommendations():
+    """
+    Disable many recommendations
+    This endpoint will disable every recommendation matching the query string
+    """
+    app.logger.info("Request to disable recommendations")
+    return set_status_by_filters(Status.DISABLED)
+
+######################################################################
+# SERVICE STATISTICS
+######################################################################
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    """
+    Returns internal counters for sizing the service
+    This endpoint reports the hit and miss counts of the recommendation cache,
+    the size of the in-memory snapshot, the connection pool counters, the
+    number of reads that shared a query and the group commit batches, all of
+    the worker that answers
+    """
+    app.logger.info("Request for service statistics")
+    return make_response(
+        jsonify(
+            cache=src_cache.stats(),
+            snapshot=src_snapshot.stats(),
+            pool=pool_monitor.stats(),
+            single_flight=read_flights.stats(),
+            group_commit=group_commit.stats(),
+        ),
+        status.HTTP_200_OK,
+    )
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Returns request metrics in the Prometheus text exposition format
+    This endpoint reports request counts, latency and response size
+    histograms and in-flight requests per route, added up over every worker
+    """
+    body, content_type = metrics.render()
+    return Response(body, status.HTTP_200_OK, content_type=content_type)
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
-def check_content_type(media_type):
+def check_content_type(*media_types):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
-    if content_type and content_type == media_type:
+    if content_type and content_type in media_types:
         return
     app.logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-        "Content-Type must be {}".format(media_type),
+        "Content-Type must be {}".format(" or ".join(media_types)),
+    )
+
+def read_bulk_items():
+    """
+    Reads the items of a bulk request body
+
+    Returns a list of (index, data) pairs and a list of per-item errors for
+    NDJSON lines that are not valid JSON
+    """
+    errors = []
+    if request.headers.get("Content-Type") == NDJSON:
+        items = []
+        for index, line in enumerate(request.get_data(as_text=True).splitlines()):
+            if not line.strip():
+                continue
+            try:
+                items.append((index, json.loads(line)))
+            except ValueError as error:
+                errors.append({"index": index, "message": "Invalid JSON: " + str(error)})
+    else:
+        data = request.get_json()
+        if not isinstance(data, list):
+            raise DataValidationError("Invalid bulk request: body must be a JSON array")
+        items = list(enumerate(data))
+    if len(items) + len(errors) > app.config["BULK_MAX_ITEMS"]:
+        raise DataValidationError(
+            "Invalid bulk request: at most {} items are allowed".format(app.config["BULK_MAX_ITEMS"])
+        )
+    return items, errors
+
+def get_page_args(limit, after):
+    """Validates the limit and after cursor of a paginated request"""
+    try:
+        limit = int(limit) if limit else app.config["DEFAULT_PAGE_SIZE"]
+        after = int(after) if after else None
+    except ValueError as error:
+        raise DataValidationError("Invalid pagination parameter: " + str(error))
+    if limit < 1:
+        raise DataValidationError("Invalid pagination parameter: limit must be positive")
+    return min(limit, app.config["MAX_PAGE_SIZE"]), after
+
+def get_top(top):
+    """Validates the number of top scored Recommendations asked for, or None for a plain listing"""
+    if top is None or top == "":
+        return None
+    try:
+        top = int(top)
+    except ValueError as error:
+        raise DataValidationError("Invalid top parameter: " + str(error))
+    if top < 1:
+        raise DataValidationError("Invalid top parameter: top must be positive")
+    return min(top, app.config["MAX_PAGE_SIZE"])
+
+def page_of(results, limit, after):
+    """Returns one page of serialized results ordered by id and the next cursor"""
+    if after is not None:
+        results = [result for result in results if result["id"] > after]
+    next_cursor = results[limit - 1]["id"] if len(results) > limit else None
+    return results[:limit], next_cursor
+
+def page_headers(next_cursor, limit):
+    """Returns a Link header pointing at the next page, if there is one"""
+    if next_cursor is None:
+        return {}
+    args = request.args.to_dict()
+    args.update(limit=limit, after=next_cursor)
+    return {"Link": '<{}?{}>; rel="next"'.format(request.base_url, urlencode(args))}
+
+def set_status_by_filters(new_status):
+    """Sets the status of every Recommendation matching the query string"""
+    filters = get_filters(request.args)
+    if not filters:
+        raise DataValidationError("Changing the status of recommendations requires a filter")
+    count = Recommendation.update_by_filters({"status": new_status}, **filters)
+    app.logger.info("Set %d recommendations matching %s to %s.", count, filters, new_status.name)
+    return make_response(jsonify(updated=count), status.HTTP_200_OK)
+
+def get_action_values(new_status):
+    """
+    Returns the column values set by an enable or disable action
+
+    A Recommendation in the body is applied along with the new status, an
+    empty body only changes the status. Any other body must be valid JSON.
+    """
+    if not request.get_data():
+        return {"status": new_status}
+    check_content_type("application/json")
+    values = Recommendation().deserialize(request.get_json()).column_values()
+    values["status"] = new_status
+    return values
+
+def get_filters(args):
+    """Returns the list filters that are set in the request arguments"""
+    filters = {}
+    for name in ("src_product_id", "rec_product_id", "type", "status"):
+        value = args.get(name)
+        if value is not None and value != "":
+            filters[name] = value
+    if "src_product_id" in filters:
+        filters["src_product_id"] = get_id_list(str(filters["src_product_id"]))
+    if "rec_product_id" in filters:
+        try:
+            filters["rec_product_id"] = int(filters["rec_product_id"])
+        except ValueError as error:
+            raise DataValidationError("Invalid rec_product_id: " + str(error))
+    return filters
+
+def list_page(filters, limit, after, top=None):
+    """
+    Returns one page of serialized Recommendations matching the filters
+
+    Lookups by a single source product are served from the read-through
+    cache, everything else runs as one filtered query. With top the highest
+    scored Recommendations are returned instead of a page.
+    """
+    source_id = cached_source_id(filters)
+    if top is not None:
+        if source_id is not None:
+            return Recommendation.find_top_by_src_id_cached(source_id, top), None
+        return [dict(row._mapping) for row in Recommendation.find_top_rows(top, **filters)], None
+    if source_id is not None:
+        return page_of(Recommendation.find_by_src_id_cached(source_id), limit, after)
+    recommendations, next_cursor = Recommendation.find_page(
+        Recommendation.find_by_filters(**filters), limit, after
     )
+    return [recommendation.serialize() for recommendation in recommendations], next_cursor
+
+def list_response(filters, limit, after, top=None):
+    """
+    Returns a JSON response with one page of Recommendations matching the filters
+
+    Lookups by a single source product are served from the read-through
+    cache and tagged with the version of the source product, so an unchanged
+    source is answered with 304 Not Modified before anything is looked up.
+    Everything else is serialized straight from plain rows and tagged with a
+    hash of the body. With top the highest scored Recommendations are
+    returned in score order instead of a page.
+    """
+    source_id = cached_source_id(filters)
+    if source_id is None:
+        if top is not None:
+            results, next_cursor = Recommendation.find_top_rows(top, **filters), None
+        else:
+            results, next_cursor = Recommendation.find_rows_page(limit, after, **filters)
+        with measure("serialize"):
+            body = "[" + ",".join(Recommendation.serialize_rows_json(results)) + "]"
+        app.logger.info("Returning %d recommendations", len(results))
+        return conditional_response(
+            Response(body, status.HTTP_200_OK, page_headers(next_cursor, limit), mimetype="application/json")
+        )
+
+    etag = src_versions.tag(source_id)  # before the data, see VersionTags.tag()
+    if top is not None:
+        etag += ".top{}".format(top)
+    if request.if_none_match.contains(etag):
+        app.logger.info("Recommendations of source %s not modified", source_id)
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        response.set_etag(etag)
+        return response
+    if top is not None:
+        results, next_cursor = Recommendation.find_top_by_src_id_cached(source_id, top), None
+    else:
+        results, next_cursor = page_of(Recommendation.find_by_src_id_cached(source_id), limit, after)
+    app.logger.info("Returning %d recommendations", len(results))
+    with measure("serialize"):
+        body = json.dumps(results)
+    response = Response(body, status.HTTP_200_OK, page_headers(next_cursor, limit), mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+def row_response(row):
+    """Returns a JSON response with a single Recommendation row"""
+    with measure("serialize"):
+        body = Recommendation.serialize_rows_json([row])[0]
+    return conditional_response(Response(body, status.HTTP_200_OK, mimetype="application/json"))
+
+def conditional_response(response):
+    """Tags a response with a hash of its body and answers If-None-Match with 304"""
+    response.add_etag()
+    return response.make_conditional(request)
+
+def cached_source_id(filters):
+    """Returns the source product id of a plain source lookup, or None"""
+    source_ids = filters.get("src_product_id", [])
+    if len(filters) == 1 and len(source_ids) == 1:
+        return source_ids[0]
+    return None
+
+def get_id_list(value):
+    """Parses a comma separated list of ids, enforcing the lookup limit"""
+    try:
+        ids = [int(item) for item in value.split(",") if item.strip()]
+    except ValueError as error:
+        raise DataValidationError("Invalid id list: " + str(error))
+    if len(ids) > app.config["MAX_LOOKUP_IDS"]:
+        raise DataValidationError(
+            "Invalid id list: at most {} ids are allowed".format(app.config["MAX_LOOKUP_IDS"])
+        )
+    return ids
+
+def stream_requested():
+    """Checks whether the client asked for a streamed listing"""
+    if request.accept_mimetypes.best == NDJSON:
+        return True
+    return request.args.get("stream", "").lower() in ("true", "1", "yes")
+
+def stream_recommendations(filters):
+    """
+    Streams the Recommendations matching the filters without holding them all in memory
+
+    Rows are fetched through a server side cursor and written out as NDJSON
+    when the client accepts it, or as a single JSON array otherwise
+    """
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+    ndjson = request.accept_mimetypes.best == NDJSON
+
+    def generate():
+        first = True
+        if not ndjson:
+            yield "["
+        for rows in Recommendation.stream_rows(batch_size, **filters):
+            lines = Recommendation.serialize_rows_json(rows)
+            if ndjson:
+                yield "\n".join(lines) + "\n"
+            else:
+                yield ("" if first else ",") + ",".join(lines)
+                first = False
+        if not ndjson:
+            yield "]"
+
+    mimetype = NDJSON if ndjson else "application/json"
+    return Response(stream_with_context(generate()), status.HTTP_200_OK, mimetype=mimetype)
 
 def init_db():
     """ Initializes the SQLAlchemy app """
@@ -0,0 +1,210 @@
+"""
+In-memory adjacency index of Recommendations
+
+The index is a read-only snapshot of the Recommendation table keyed by source
+product id and kept in compressed sparse row (CSR) form: a sorted array of the
+source product ids, an offsets table into the row arrays, and one flat array
+per column. A lookup is a binary search and a slice, and no Python object is
+kept per row.
+"""
+import bisect
+import logging
+import threading
+import time
+from array import array
+
+logger = logging.getLogger("flask.app")
+
+
+class AdjacencyIndex:
+    """An immutable CSR index of Recommendations grouped by source product"""
+
+    def __init__(self, rows=()):
+        """
+        Builds the index from (id, src_product_id, rec_product_id, type, status, score)
+        rows sorted by source product id, where type and status are enum values
+        """
+        self.sources = array("q")
+        self.offsets = array("q")
+        self.ids = array("q")
+        self.recs = array("q")
+        self.scores = array("d")
+        self.types = array("b")
+        self.statuses = array("b")
+        for id, src_product_id, rec_product_id, type_value, status_value, score in rows:
+            if not self.sources or self.sources[-1] != src_product_id:
+                if self.sources and self.sources[-1] > src_product_id:
+                    raise ValueError("Rows must be sorted by source product id")
+                self.sources.append(src_product_id)
+                self.offsets.append(len(self.ids))
+            self.ids.append(id)
+            self.recs.append(rec_product_id)
+            self.scores.append(score)
+            self.types.append(type_value)
+            self.statuses.append(status_value)
+        self.offsets.append(len(self.ids))
+
+    def lookup(self, src_product_id: int) -> list:
+        """Returns the rows of a source product in the order they were added"""
+        i = bisect.bisect_left(self.sources, src_product_id)
+        if i == len(self.sources) or self.sources[i] != src_product_id:
+            return []
+        return [
+            (self.ids[j], src_product_id, self.recs[j], self.types[j], self.statuses[j], self.scores[j])
+            for j in range(self.offsets[i], self.offsets[i + 1])
+        ]
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the arrays of the index"""
+        arrays = (self.sources, self.offsets, self.ids, self.recs, self.scores, self.types, self.statuses)
+        return sum(len(column) * column.itemsize for column in arrays)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class AdjacencySnapshot:
+    """
+    Serves source product lookups from an AdjacencyIndex
+
+    Source products written by this process are reloaded one at a time on
+    their next lookup, and the whole index is rebuilt in a background thread
+    every refresh_interval seconds to pick up writes made by other processes.
+    An index that is not read from the table, like a graph file, can be kept
+    current with a changes function listing the source products written since
+    it was taken; they are reloaded like local writes.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.refresh_interval = 60.0
+        self.built_at = 0.0
+        self._refresh_at = 0.0
+        self._build = None
+        self._load_source = None
+        self._changes = None
+        self._overlay = {}
+        self._dirty = set()
+        self._written_during_rebuild = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """The snapshot serves lookups once it has been built"""
+        return self.index is not None
+
+    def start(self, build, load_source, refresh_interval: float = 60.0, changes=None):
+        """
+        Builds the first index and starts serving from it
+
+        :param build: returns a new AdjacencyIndex of the whole table, or the
+            current one when nothing has changed
+        :param load_source: returns the current rows of one source product
+        :param refresh_interval: seconds between full rebuilds (0 never rebuilds)
+        :param changes: returns the source products written since an index was
+            taken, or since it was last called for the same index
+        """
+        self._build = build
+        self._load_source = load_source
+        self._changes = changes
+        self.refresh_interval = refresh_interval
+        self.rebuild()
+
+    def stop(self):
+        """Drops the index and stops serving lookups"""
+        with self._lock:
+            self.index = None
+            self._overlay = {}
+            self._dirty = set()
+
+    def rebuild(self):
+        """Builds a new index of the whole table and swaps it in"""
+        with self._lock:
+            if self._written_during_rebuild is not None:
+                return  # another thread is already rebuilding
+            self._written_during_rebuild = set()
+        try:
+            index = self._build()
+            changed = self._changes(index) if self._changes else ()
+        except Exception:
+            with self._lock:
+                self._written_during_rebuild = None
+                self._refresh_at = time.monotonic() + self.refresh_interval
+            raise
+        with self._lock:
+            self._refresh_at = time.monotonic() + self.refresh_interval
+            if index is not self.index:
+                self.index = index
+                self.built_at = time.monotonic()
+                self._overlay = {}
+                self._dirty = self._written_during_rebuild
+            if changed:
+                self._generation += 1
+                for source_id in changed:
+                    self._overlay.pop(source_id, None)
+                    self._dirty.add(source_id)
+            self._written_during_rebuild = None
+
+    def invalidate(self, *source_ids):
+        """Marks source products as changed so their next lookup reloads them"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._generation += 1
+            for source_id in source_ids:
+                self._overlay.pop(source_id, None)
+                self._dirty.add(source_id)
+                if self._written_during_rebuild is not None:
+                    self._written_during_rebuild.add(source_id)
+
+    def lookup(self, src_product_id: int) -> list:
+        """Returns the (id, src_product_id, rec_product_id, type, status, score) rows of a source"""
+        with self._lock:
+            rows = self._overlay.get(src_product_id)
+            if rows is not None:
+                return rows
+            dirty = src_product_id in self._dirty
+            generation = self._generation
+            index = self.index
+        if dirty:
+            rows = self._load_source(src_product_id)
+            with self._lock:
+                if generation == self._generation:
+                    self._dirty.discard(src_product_id)
+                    self._overlay[src_product_id] = rows
+            return rows
+        self._refresh_if_stale()
+        return index.lookup(src_product_id)
+
+    def _refresh_if_stale(self):
+        """Starts a background rebuild once the index is older than the refresh interval"""
+        if not self.refresh_interval or time.monotonic() < self._refresh_at:
+            return
+        with self._lock:
+            if self._written_during_rebuild is not None:
+                return
+            self._refresh_at = time.monotonic() + self.refresh_interval
+        threading.Thread(target=self._rebuild_in_background, name="adjacency-refresh", daemon=True).start()
+
+    def _rebuild_in_background(self):
+        """Rebuilds the index, logging instead of raising any error"""
+        try:
+            self.rebuild()
+            logger.info("Rebuilt adjacency snapshot with %d rows", len(self.index))
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Adjacency snapshot rebuild failed: %s", error)
+
+    def stats(self) -> dict:
+        """Returns the size and age of the snapshot as a dictionary"""
+        with self._lock:
+            index = self.index
+            return {
+                "enabled": index is not None,
+                "rows": len(index) if index is not None else 0,
+                "sources": len(index.sources) if index is not None else 0,
+                "bytes": index.nbytes if index is not None else 0,
+                "age": round(time.monotonic() - self.built_at, 3) if index is not None else None,
+                "dirty": len(self._dirty),
+            }
@@ -0,0 +1,131 @@
+"""
+Read-through cache for Recommendation lookups
+
+A small, thread safe LRU cache with an optional time-to-live. Entries are
+evicted in least-recently-used order once the cache is full, and are treated
+as missing once they are older than the TTL. The TTL also bounds how long
+another worker process can keep serving data that was changed elsewhere.
+
+A value loaded while its key is invalidated may have been read before the
+write that invalidated it, so every key has an invalidation count: read it
+with generation() before loading and pass it to put(), which then drops the
+value when the key was invalidated in between.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A bounded LRU cache with TTL expiry and hit/miss counters"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._generations = {}
+        self._resets = 0
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize: int, ttl: float):
+        """Resizes the cache and drops everything in it"""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._data.clear()
+            self._reset_generations()
+
+    @property
+    def enabled(self) -> bool:
+        """A cache with no room is switched off"""
+        return self.maxsize > 0
+
+    def get(self, key):
+        """Returns the cached value for key or None when it is missing or stale"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if not self.ttl or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def generation(self, key):
+        """Returns the invalidation count of key, to pass to put() along with the value loaded after it"""
+        with self._lock:
+            return self._resets, self._generations.get(key, 0)
+
+    def put(self, key, value, generation=None):
+        """Stores value under key, evicting the least recently used entries
+
+        When generation is given the value is only stored if key has not been
+        invalidated since generation() returned it
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != (self._resets, self._generations.get(key, 0)):
+                return  # loaded before a write to key, so possibly stale
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for key, calling loader() to fill a miss"""
+        if not self.enabled:
+            return loader()
+        value = self.get(key)
+        if value is None:
+            generation = self.generation(key)
+            value = loader()
+            self.put(key, value, generation)
+        return value
+
+    def invalidate(self, *keys):
+        """Removes the given keys from the cache and bumps their invalidation counts"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+            if len(self._generations) > 4 * max(self.maxsize, 256):
+                self._reset_generations()
+
+    def clear(self):
+        """Removes every entry and resets the counters"""
+        with self._lock:
+            self._data.clear()
+            self._reset_generations()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def _reset_generations(self):
+        # forgetting the counts must still fail every load in flight, hence the reset count
+        self._generations.clear()
+        self._resets += 1
+
+    def stats(self) -> dict:
+        """Returns the cache counters as a dictionary"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
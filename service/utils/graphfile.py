@@ -0,0 +1,123 @@
+"""
+Memory-mapped recommendation graph file
+
+An AdjacencyIndex written to disk so that every worker process can map the
+same file read-only and share its pages through the page cache. The layout is
+a fixed header followed by the columns of the index, each a flat array in
+native byte order:
+
+    header   magic "RECG", version, source count, row count, watermark
+    sources  int64 * sources    sorted source product ids
+    offsets  int64 * sources+1  first row of each source product
+    ids      int64 * rows       recommendation ids
+    recs     int64 * rows       recommended product ids
+    scores   float64 * rows     scores
+    types    int8 * rows        Type values
+    statuses int8 * rows        Status values
+
+Files are written to a temporary name and renamed into place, so a reader
+never sees a partly written file and can pick up a new one by reopening it.
+The watermark is an opaque number given by the writer; the models store the
+oldest transaction the export could not see, so that readers can reload the
+source products written since.
+"""
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+
+from service.utils.adjacency import AdjacencyIndex
+
+MAGIC = b"RECG"
+VERSION = 3
+HEADER = struct.Struct("=4sIQQQ")
+
+
+def write_graph_file(path: str, rows, watermark: int = 0) -> int:
+    """
+    Writes (id, src_product_id, rec_product_id, type, status, score) rows to a graph file
+
+    The rows must be sorted by source product id. The new file atomically
+    replaces any file already at path. The watermark is stored in the header
+    for readers to find out which rows may have changed since.
+
+    :return: the number of rows written
+    :rtype: int
+    """
+    index = AdjacencyIndex(rows)
+    columns = (index.sources, index.offsets, index.ids, index.recs, index.scores, index.types, index.statuses)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".graph-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as graph:
+            graph.write(HEADER.pack(MAGIC, VERSION, len(index.sources), len(index), watermark))
+            for column in columns:
+                column.tofile(graph)
+            graph.flush()
+            os.fsync(graph.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(index)
+
+
+class GraphFile:
+    """A read-only, memory-mapped graph file with the AdjacencyIndex interface"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as graph:
+            stat = os.fstat(graph.fileno())
+            self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._mmap = mmap.mmap(graph.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < HEADER.size:
+            raise ValueError("{} is not a graph file".format(path))
+        magic, version, source_count, row_count, self.watermark = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} graph file".format(path, VERSION))
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+        columns = []
+        for count, fmt, size in (
+            (source_count, "q", 8),
+            (source_count + 1, "q", 8),
+            (row_count, "q", 8),
+            (row_count, "q", 8),
+            (row_count, "d", 8),
+            (row_count, "b", 1),
+            (row_count, "b", 1),
+        ):
+            columns.append(view[offset:offset + count * size].cast(fmt))
+            offset += count * size
+        if offset != len(self._mmap):
+            raise ValueError("{} is truncated or corrupt".format(path))
+        self.sources, self.offsets, self.ids, self.recs, self.scores, self.types, self.statuses = columns
+
+    def changed(self) -> bool:
+        """Checks whether a different file has been moved into place since this one was opened"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size) != self.identity
+
+    def lookup(self, src_product_id: int) -> list:
+        """Returns the rows of a source product in id order"""
+        i = bisect.bisect_left(self.sources, src_product_id)
+        if i == len(self.sources) or self.sources[i] != src_product_id:
+            return []
+        return [
+            (self.ids[j], src_product_id, self.recs[j], self.types[j], self.statuses[j], self.scores[j])
+            for j in range(self.offsets[i], self.offsets[i + 1])
+        ]
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the mapped file"""
+        return len(self._mmap)
+
+    def __len__(self):
+        return len(self.ids)
@@ -0,0 +1,132 @@
+"""
+Group commit of concurrent writes
+
+Every commit waits for the database to flush its log to disk, so a process
+that commits each created row on its own is limited to one row per flush.
+Here the rows of concurrent callers are queued and written by one background
+thread in shared transactions instead: it takes whatever is queued, waits up
+to a short window for more (or until a batch is full) and hands the batch to
+a write function. The next batch collects while the previous one commits, so
+batches grow with the load and a lone caller only waits for the window.
+
+Each caller blocks until its batch is committed and then gets its own result,
+or its own error: the write function returns one result per item, and an
+exception in place of the result of an item that could not be written.
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger("flask.app")
+
+
+class _Pending:
+    """An item waiting for its batch to be committed"""
+
+    def __init__(self, item):
+        self.item = item
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommit:
+    """Writes the items of concurrent callers in shared transactions"""
+
+    def __init__(self):
+        self.enabled = False
+        self.window = 0.002
+        self.max_batch = 100
+        self.batches = 0
+        self.items = 0
+        self._write = None
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def configure(self, write, window_ms: float = 2.0, max_batch: int = 100, enabled: bool = True):
+        """
+        Sets how batches are written and how large they get
+
+        :param write: writes a list of items in one transaction and returns
+            one result per item, with an exception for each item that failed
+        :param window_ms: how long a batch waits for more items
+        :param max_batch: the largest number of items in one batch
+        :param enabled: whether submit() may be used
+        """
+        self._write = write
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.enabled = enabled
+
+    def submit(self, item):
+        """Queues item for the next batch and returns its result once committed
+
+        :raises: the error of the item when it could not be written
+        """
+        pending = _Pending(item)
+        self._queue.put(pending)
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._worker.start()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def stats(self) -> dict:
+        """Returns the batch counters as a dictionary"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            }
+
+    def clear(self):
+        """Resets the counters"""
+        with self._lock:
+            self.batches = 0
+            self.items = 0
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self._write([pending.item for pending in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError("{} results for {} items".format(len(results), len(batch)))
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Group commit of %d items failed: %s", len(batch), error)
+                results = [error] * len(batch)
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+            for pending, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    pending.error = result
+                else:
+                    pending.result = result
+                pending.done.set()
+
+    def _collect(self) -> list:
+        """Waits for an item and returns it with everything queued within the window"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
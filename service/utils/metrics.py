@@ -0,0 +1,123 @@
+"""
+Prometheus metrics
+
+Counts every request and records its latency and response size per route,
+plus the number of requests in flight, for the /metrics endpoint. Routes are
+labelled with their URL rule (e.g. /api/recommendations/<recommendation_id>)
+so that the plain Flask routes and the Flask-RESTX resources are reported
+the same way and the number of label values stays bounded.
+
+The connection pool of every worker is exported too (see PoolMonitor), as
+gauges that keep one series per worker process instead of adding them up,
+since the pool is sized per worker.
+
+Under gunicorn each worker keeps its own metrics. Set PROMETHEUS_MULTIPROC_DIR
+to an empty directory before the workers start so that they write their
+metrics there, and /metrics then adds up the files of every worker
+(see gunicorn.conf.py).
+"""
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+REQUESTS = Counter(
+    "http_requests_total", "Requests served", ["method", "route", "status"]
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request", ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of response bodies", ["method", "route"],
+    buckets=SIZE_BUCKETS,
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being handled", ["method", "route"],
+    multiprocess_mode="livesum",
+)
+
+
+# Connection pool of each worker, see service.utils.pool. The pid label is
+# added by the multiprocess collector, and the series of a worker go away
+# when it exits.
+POOL_SIZE = Gauge("db_pool_size", "Connections kept open by the pool", multiprocess_mode="liveall")
+POOL_IN_USE = Gauge("db_pool_connections_in_use", "Connections checked out of the pool", multiprocess_mode="liveall")
+POOL_IDLE = Gauge("db_pool_connections_idle", "Connections idle in the pool", multiprocess_mode="liveall")
+POOL_OVERFLOW = Gauge("db_pool_overflow", "Overflow connections open beyond the pool size", multiprocess_mode="liveall")
+POOL_CONNECTS = Gauge("db_pool_connects", "Connections opened", multiprocess_mode="liveall")
+POOL_OVERFLOWS = Gauge("db_pool_overflows", "Overflow connections opened", multiprocess_mode="liveall")
+POOL_CHECKOUTS = Gauge("db_pool_checkouts", "Connections handed out", multiprocess_mode="liveall")
+POOL_TIMEOUTS = Gauge("db_pool_timeouts", "Checkouts that timed out", multiprocess_mode="liveall")
+POOL_INVALIDATIONS = Gauge("db_pool_invalidations", "Connections invalidated", multiprocess_mode="liveall")
+POOL_WAITS = Gauge("db_pool_waits", "Checkouts timed while waiting for a connection", multiprocess_mode="liveall")
+POOL_WAIT_SECONDS = Gauge(
+    "db_pool_wait_seconds", "Total time checkouts waited for a connection", multiprocess_mode="liveall"
+)
+POOL_WAIT_MAX_SECONDS = Gauge(
+    "db_pool_wait_max_seconds", "Longest time a checkout waited for a connection", multiprocess_mode="liveall"
+)
+
+
+def init_app(app):
+    """Records the requests of app"""
+    app.before_request(_start_request)
+    app.after_request(_record_response)
+    app.teardown_request(_finish_request)
+
+
+def observe(method: str, route: str, status_code: int, seconds: float, size: int = None):
+    """Records a finished request, for servers that answer requests without Flask"""
+    LATENCY.labels(method, route).observe(seconds)
+    REQUESTS.labels(method, route, str(status_code)).inc()
+    if size is not None:
+        RESPONSE_SIZE.labels(method, route).observe(size)
+
+
+def render() -> tuple:
+    """Returns the current metrics and their content type"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def _route():
+    """The URL rule of the current request, or a fixed label when none matched"""
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def _start_request():
+    labels = (request.method, _route())
+    g.metrics_start = (time.perf_counter(), labels)
+    IN_PROGRESS.labels(*labels).inc()
+
+
+def _record_response(response):
+    start = g.get("metrics_start")
+    if start is None:
+        return response
+    started, (method, route) = start
+    observe(method, route, response.status_code, time.perf_counter() - started, response.content_length)
+    return response
+
+
+def _finish_request(error):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        IN_PROGRESS.labels(*start[1]).dec()
@@ -0,0 +1,154 @@
+"""
+Connection pool instrumentation
+
+Counts what the SQLAlchemy connection pool of this worker process does with
+pool events (new connections, overflow connections, checkouts, invalidations)
+and times how long each checkout had to wait for a connection. Together with
+the in-use and idle gauges of the pool itself this shows whether requests
+are queueing for a connection and how large the pool of each worker should
+be.
+
+The same numbers are kept in the db_pool_* Prometheus gauges as they change,
+so that /metrics reports them for every worker, not only the one that
+answers /stats.
+"""
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+from service.utils import metrics
+
+
+class PoolMonitor:
+    """Counters and checkout wait times of a QueuePool"""
+
+    def __init__(self):
+        self._engine = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.connects = 0
+        self.overflows = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.invalidations = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def queue_pool_class(self):
+        """
+        A QueuePool class that reports checkout wait times to this monitor
+
+        Pass it as the poolclass engine option. Pool events fire only once a
+        connection has been handed out, so the wait is timed around the get
+        from the pool queue instead. The in-use and idle gauges are set after
+        every get and return, as the checkin event fires before the
+        connection is back in the queue.
+        """
+        monitor = self
+
+        class MonitoredQueuePool(QueuePool):
+            """A QueuePool that times every wait for a connection"""
+
+            def _do_get(self):
+                start = time.perf_counter()
+                try:
+                    record = super()._do_get()
+                except exc.TimeoutError:
+                    monitor.record_wait(time.perf_counter() - start, timed_out=True)
+                    raise
+                monitor.record_wait(time.perf_counter() - start)
+                monitor.export_pool(self)
+                return record
+
+            def _do_return_conn(self, record):
+                super()._do_return_conn(record)
+                monitor.export_pool(self)
+
+        return MonitoredQueuePool
+
+    def attach(self, engine):
+        """Starts counting the pool events of engine"""
+        self._engine = engine
+        if not event.contains(engine, "connect", self._on_connect):
+            event.listen(engine, "connect", self._on_connect)
+            event.listen(engine, "checkout", self._on_checkout)
+            event.listen(engine, "invalidate", self._on_invalidate)
+        self.export_pool(engine.pool)
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        """Adds the time one checkout waited for a connection"""
+        with self._lock:
+            self.waits += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+            metrics.POOL_WAITS.set(self.waits)
+            metrics.POOL_WAIT_SECONDS.set(self.wait_total)
+            metrics.POOL_WAIT_MAX_SECONDS.set(self.wait_max)
+            metrics.POOL_TIMEOUTS.set(self.timeouts)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        pool = self._engine.pool
+        with self._lock:
+            self.connects += 1
+            if isinstance(pool, QueuePool) and pool.overflow() > 0:
+                self.overflows += 1
+            metrics.POOL_CONNECTS.set(self.connects)
+            metrics.POOL_OVERFLOWS.set(self.overflows)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            metrics.POOL_CHECKOUTS.set(self.checkouts)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+            metrics.POOL_INVALIDATIONS.set(self.invalidations)
+
+    @staticmethod
+    def export_pool(pool):
+        """Sets the gauges of the connections held by pool"""
+        if not isinstance(pool, QueuePool):
+            return
+        metrics.POOL_SIZE.set(pool.size())
+        metrics.POOL_IN_USE.set(pool.checkedout())
+        metrics.POOL_IDLE.set(pool.checkedin())
+        metrics.POOL_OVERFLOW.set(max(pool.overflow(), 0))
+
+    def clear(self):
+        """Resets the counters"""
+        with self._lock:
+            self._reset()
+            for gauge in (
+                metrics.POOL_CONNECTS, metrics.POOL_OVERFLOWS, metrics.POOL_CHECKOUTS, metrics.POOL_TIMEOUTS,
+                metrics.POOL_INVALIDATIONS, metrics.POOL_WAITS, metrics.POOL_WAIT_SECONDS, metrics.POOL_WAIT_MAX_SECONDS,
+            ):
+                gauge.set(0)
+        if self._engine is not None:
+            self.export_pool(self._engine.pool)
+
+    def stats(self) -> dict:
+        """Returns the pool gauges and counters as a dictionary"""
+        pool = self._engine.pool if self._engine is not None else None
+        queue_pool = isinstance(pool, QueuePool)
+        with self._lock:
+            return {
+                "size": pool.size() if queue_pool else None,
+                "in_use": pool.checkedout() if queue_pool else None,
+                "idle": pool.checkedin() if queue_pool else None,
+                "overflow": max(pool.overflow(), 0) if queue_pool else None,
+                "connects": self.connects,
+                "overflows": self.overflows,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "invalidations": self.invalidations,
+                "wait_ms_avg": round(1000 * self.wait_total / self.waits, 3) if self.waits else 0.0,
+                "wait_ms_max": round(1000 * self.wait_max, 3),
+            }
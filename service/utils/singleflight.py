@@ -0,0 +1,118 @@
+"""
+Single-flight read coalescing
+
+When many requests ask for the same thing at the same moment, for example a
+popular product whose cached lookup just expired, only the first of them
+runs the database query and the others wait for its result instead of each
+taking a connection from the pool. Calls are only shared while they are in
+flight, nothing is kept once they finish.
+
+Results are handed to every waiting caller as they are, so only share calls
+that return data nobody changes in place, such as plain rows or serialized
+dictionaries, never ORM instances bound to the session of another thread.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    """A call in flight and its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Shares the result of one in-flight call per key with concurrent callers"""
+
+    def __init__(self):
+        self.enabled = True
+        self.calls = 0
+        self.shared = 0
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool):
+        """Turns coalescing on or off"""
+        self.enabled = enabled
+
+    def do(self, key, function):
+        """Returns function(), or the result of the call for key already in flight"""
+        if not self.enabled:
+            return function()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key, function):
+        """Awaits function(), or the call for key already in flight on this event loop"""
+        if not self.enabled:
+            return await function()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get((loop, key))
+            if task is None:
+                task = self._tasks[(loop, key)] = loop.create_task(function())
+                task.add_done_callback(lambda done: self._forget_task((loop, key), done))
+                self.calls += 1
+            else:
+                self.shared += 1
+        # one caller giving up must not cancel the call the others wait for
+        return await asyncio.shield(task)
+
+    def _forget_task(self, task_key, task):
+        with self._lock:
+            if self._tasks.get(task_key) is task:
+                del self._tasks[task_key]
+
+    def forget(self):
+        """Makes later callers start new calls instead of joining the ones in flight
+
+        Call it after a write, so that no caller arriving after the write is
+        handed a result read before it.
+        """
+        with self._lock:
+            self._calls.clear()
+            self._tasks.clear()
+
+    def clear(self):
+        """Forgets the calls in flight and resets the counters"""
+        with self._lock:
+            self._calls.clear()
+            self._tasks.clear()
+            self.calls = 0
+            self.shared = 0
+
+    def stats(self) -> dict:
+        """Returns the coalescing counters as a dictionary"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._calls) + len(self._tasks),
+                "calls": self.calls,
+                "shared": self.shared,
+            }
@@ -0,0 +1,126 @@
+"""
+Slow query log
+
+Times every SQL statement with the SQLAlchemy cursor execute events and logs
+the ones slower than a threshold as one JSON line with the statement, its
+duration, the route that ran it and, when allowed, its parameters. Parameters
+are redacted by default since they can hold customer data.
+
+Optionally the plan of each slow statement is captured with a plain EXPLAIN
+(which does not run the statement) on a background thread, at most once an
+hour per statement, so that an index regression shows up in the logs
+without turning on logging in Postgres itself.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from service.utils.cache import LRUCache
+
+logger = logging.getLogger("flask.app")
+
+# only statements that EXPLAIN accepts
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+class SlowQueryLog:
+    """Logs SQL statements slower than a threshold"""
+
+    def __init__(self):
+        self.threshold = 0.0
+        self.log_params = False
+        self.explain = False
+        self._explained = LRUCache(maxsize=256, ttl=3600)
+        self._plans = queue.Queue(maxsize=100)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def configure(self, threshold_ms: float, log_params: bool = False, explain: bool = False):
+        """
+        Sets what gets logged
+
+        :param threshold_ms: statements slower than this are logged (0 logs nothing)
+        :param log_params: log the parameters of slow statements instead of redacting them
+        :param explain: also log the query plan of slow statements
+        """
+        self.threshold = threshold_ms / 1000
+        self.log_params = log_params
+        self.explain = explain
+
+    @property
+    def enabled(self) -> bool:
+        """A threshold of 0 turns the log off"""
+        return self.threshold > 0
+
+    def attach(self, engine):
+        """Starts timing the statements of engine when the log is enabled"""
+        if self.enabled and not event.contains(engine, "before_cursor_execute", self._before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def wait(self):
+        """Blocks until every queued EXPLAIN has been logged"""
+        self._plans.join()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("slow_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if not self.enabled or elapsed < self.threshold:
+            return
+        if not context.execution_options.get("slow_query_log", True):
+            return
+        fields = {
+            "duration_ms": round(1000 * elapsed, 3),
+            "route": "{} {}".format(request.method, request.path) if has_request_context() else None,
+            "endpoint": request.endpoint if has_request_context() else None,
+            "statement": statement,
+            "parameters": parameters if self.log_params else redact(parameters),
+        }
+        logger.warning("slow query %s", json.dumps(fields, default=str))
+        if self.explain and not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+            self._queue_explain(conn.engine, statement, parameters)
+
+    def _queue_explain(self, engine, statement, parameters):
+        """Hands a statement to the EXPLAIN thread unless it was explained recently"""
+        if self._explained.get(statement) is not None:
+            return
+        self._explained.put(statement, True)
+        try:
+            self._plans.put_nowait((engine, statement, parameters))
+        except queue.Full:
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._explain_worker, name="slow-query-explain", daemon=True)
+                self._worker.start()
+
+    def _explain_worker(self):
+        while True:
+            engine, statement, parameters = self._plans.get()
+            try:
+                with engine.connect().execution_options(slow_query_log=False) as conn:
+                    plan = [row[0] for row in conn.exec_driver_sql("EXPLAIN " + statement, parameters)]
+                logger.warning("slow query plan %s", json.dumps({"statement": statement, "plan": plan}, default=str))
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Could not explain slow query: %s", error)
+            finally:
+                self._plans.task_done()
+
+
+def redact(parameters):
+    """Replaces every parameter value with a placeholder, keeping names and positions"""
+    if isinstance(parameters, dict):
+        return {name: "?" for name in parameters}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) if isinstance(value, (dict, list, tuple)) else "?" for value in parameters]
+    return "?"
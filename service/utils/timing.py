@@ -0,0 +1,124 @@
+"""
+Per-request timing
+
+When REQUEST_TIMING is set, every request is timed: the whole handler, each
+SQL statement it runs (through the SQLAlchemy cursor execute events) and any
+block wrapped in measure(), such as serialization. The totals are sent back
+in a Server-Timing header, which browser developer tools display, and
+written out as one JSON log line per request.
+
+When REQUEST_TIMING is off nothing is registered, and measure() only checks
+whether the current request is being timed.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app")
+
+
+class RequestTimer:
+    """The time spent by one request, in seconds"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.spans = {}
+
+    def add(self, name: str, seconds: float):
+        """Adds time spent in a measured block"""
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        """Formats the timings as a Server-Timing header value in milliseconds"""
+        metrics = ['db;dur={:.2f};desc="{} queries"'.format(1000 * self.db, self.queries)]
+        metrics.extend("{};dur={:.2f}".format(name, 1000 * seconds) for name, seconds in self.spans.items())
+        metrics.append("total;dur={:.2f}".format(1000 * total))
+        return ", ".join(metrics)
+
+
+def init_app(app):
+    """Times the requests of app when REQUEST_TIMING is set in its config"""
+    if not app.config.get("REQUEST_TIMING"):
+        return
+    app.before_request(_start_timer)
+    app.after_request(_finish_timer)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def report(method: str, path: str, endpoint: str, status_code: int, total: float, timer: RequestTimer = None) -> str:
+    """Logs the timing line of a finished request and returns its Server-Timing header value
+
+    Requests answered without Flask have no RequestTimer and only report
+    their total time
+    """
+    fields = {
+        "method": method,
+        "path": path,
+        "endpoint": endpoint,
+        "status": status_code,
+        "total_ms": round(1000 * total, 3),
+    }
+    if timer is None:
+        logger.info("request timing %s", json.dumps(fields))
+        return "total;dur={:.2f}".format(1000 * total)
+    fields["db_ms"] = round(1000 * timer.db, 3)
+    fields["db_queries"] = timer.queries
+    fields.update(("{}_ms".format(name), round(1000 * seconds, 3)) for name, seconds in timer.spans.items())
+    logger.info("request timing %s", json.dumps(fields))
+    return timer.server_timing(total)
+
+
+def current_timer():
+    """Returns the RequestTimer of the current request, or None when it is not timed"""
+    return g.get("request_timer") if has_request_context() else None
+
+
+@contextmanager
+def measure(name: str):
+    """Adds the time spent in the block to the current request's timings as name"""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def _start_timer():
+    g.request_timer = RequestTimer()
+
+
+def _finish_timer(response):
+    timer = g.pop("request_timer", None)
+    if timer is None:
+        return response
+    total = time.perf_counter() - timer.start
+    response.headers["Server-Timing"] = report(
+        request.method, request.path, request.endpoint, response.status_code, total, timer
+    )
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_timer() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timer = current_timer()
+    starts = conn.info.get("query_start")
+    if timer is not None and starts:
+        timer.queries += 1
+        timer.db += time.perf_counter() - starts.pop()
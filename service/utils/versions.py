@@ -0,0 +1,51 @@
+"""
+Version tags of source products
+
+Each source product is given an opaque version tag the first time it is
+looked up, and the tag is dropped whenever the source product is written, so
+that the next lookup issues a new one. Tags are used as ETags: a client that
+sends back the current tag of a source product already has its current data.
+
+Tags are only known to the process that issued them. They are kept in an LRU
+cache with the same TTL as the lookup cache, which bounds how long a tag can
+survive a write made by another worker process.
+"""
+import itertools
+import os
+import uuid
+
+from service.utils.cache import LRUCache
+
+
+class VersionTags:
+    """Issues version tags that change whenever a key is bumped"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self._tags = LRUCache(maxsize, ttl)
+        self._epoch = uuid.uuid4().hex[:8]
+        self._counter = itertools.count(1)
+
+    def configure(self, maxsize: int, ttl: float):
+        """Resizes the tag cache and drops every tag"""
+        self._tags.configure(maxsize, ttl)
+
+    def tag(self, key) -> str:
+        """
+        Returns the current version tag of key
+
+        Read the tag before the data it describes: a write that lands in
+        between then only costs a changed tag, never a stale one.
+        """
+        return self._tags.get_or_load(key, self._next_tag)
+
+    def bump(self, *keys):
+        """Drops the tags of keys that were written"""
+        self._tags.invalidate(*keys)
+
+    def clear(self):
+        """Drops every tag"""
+        self._tags.clear()
+
+    def _next_tag(self) -> str:
+        # the pid keeps tags of workers forked from one parent apart
+        return "{}.{}.{}".format(self._epoch, os.getpid(), next(self._counter))
@@ -17,6 +17,7 @@ Test Factory to make fake objects for testing
 """
 import factory
 from factory.fuzzy import FuzzyChoice
+from factory.fuzzy import FuzzyFloat
 from factory.fuzzy import FuzzyInteger
 from service.models import Recommendation, Type, Status
 
@@ -32,3 +33,4 @@ class RecommendationFactory(factory.Factory):
     rec_product_id = FuzzyInteger(999)
     type = FuzzyChoice(choices=[Type.CROSS_SELL, Type.UP_SELL, Type.ACCESSORY])
     status = FuzzyChoice(choices=[Status.ENABLED, Status.DISABLED])
+    score = FuzzyFloat(0, 1)
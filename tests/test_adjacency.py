@@ -0,0 +1,120 @@
+"""
+Test cases for the in-memory adjacency index
+
+"""
+import time
+from unittest import TestCase
+from service.utils.adjacency import AdjacencyIndex, AdjacencySnapshot
+
+ROWS = [
+    (1, 10, 100, 0, 1, 0.5),
+    (4, 10, 101, 1, 0, 2.0),
+    (2, 20, 100, 2, 1, 0.0),
+    (3, 30, 102, 0, 1, 1.25),
+]
+
+
+######################################################################
+#  A D J A C E N C Y   I N D E X   T E S T   C A S E S
+######################################################################
+class TestAdjacencyIndex(TestCase):
+    """ Test Cases for the Adjacency Index """
+
+    def test_lookup(self):
+        """Look up the rows of a source product"""
+        index = AdjacencyIndex(ROWS)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(list(index.sources), [10, 20, 30])
+        self.assertEqual(list(index.offsets), [0, 2, 3, 4])
+        self.assertEqual(index.lookup(10), ROWS[:2])
+        self.assertEqual(index.lookup(30), ROWS[3:])
+        self.assertEqual(index.lookup(15), [])
+        self.assertEqual(index.lookup(99), [])
+
+    def test_empty(self):
+        """Look up in an empty index"""
+        index = AdjacencyIndex()
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.lookup(10), [])
+
+    def test_unsorted_rows(self):
+        """Refuse rows that are not sorted by source product"""
+        self.assertRaises(ValueError, AdjacencyIndex, list(reversed(ROWS)))
+
+    def test_nbytes(self):
+        """Report the memory used by the arrays"""
+        index = AdjacencyIndex(ROWS)
+        self.assertEqual(index.nbytes, 3 * 8 + 4 * 8 + 4 * 8 + 4 * 8 + 4 * 8 + 4 + 4)
+
+
+######################################################################
+#  A D J A C E N C Y   S N A P S H O T   T E S T   C A S E S
+######################################################################
+class TestAdjacencySnapshot(TestCase):
+    """ Test Cases for the Adjacency Snapshot """
+
+    def setUp(self):
+        self.rows = list(ROWS)
+        self.builds = 0
+        self.snapshot = AdjacencySnapshot()
+
+    def _build(self):
+        self.builds += 1
+        return AdjacencyIndex(sorted(self.rows, key=lambda row: (row[1], row[0])))
+
+    def _load_source(self, source_id):
+        return [row for row in sorted(self.rows) if row[1] == source_id]
+
+    def test_lookup(self):
+        """Serve lookups from the snapshot"""
+        self.assertFalse(self.snapshot.enabled)
+        self.snapshot.start(self._build, self._load_source, 0)
+        self.assertTrue(self.snapshot.enabled)
+        self.assertEqual(self.snapshot.lookup(20), [ROWS[2]])
+
+    def test_invalidate(self):
+        """Reload a source product after it is written"""
+        self.snapshot.start(self._build, self._load_source, 0)
+        self.rows.append((5, 20, 103, 0, 1, 0.0))
+        self.assertEqual(len(self.snapshot.lookup(20)), 1)
+        self.snapshot.invalidate(20)
+        self.assertEqual(self.snapshot.stats()["dirty"], 1)
+        self.assertEqual(len(self.snapshot.lookup(20)), 2)
+        self.assertEqual(self.snapshot.stats()["dirty"], 0)
+        self.assertEqual(self.builds, 1)
+
+    def test_changes(self):
+        """Reload the source products written elsewhere since the index was taken"""
+        changes = [[20], [], [30]]
+        index = AdjacencyIndex(ROWS)
+        self.snapshot.start(lambda: index, self._load_source, 0, lambda _: changes.pop(0))
+        self.assertEqual(self.snapshot.stats()["dirty"], 1)
+        self.rows.append((5, 20, 103, 0, 1, 0.0))
+        self.assertEqual(len(self.snapshot.lookup(20)), 2)
+        self.snapshot.rebuild()
+        self.assertEqual(len(self.snapshot.lookup(20)), 2)  # kept with the same index
+        self.rows = [row for row in self.rows if row[1] != 30]
+        self.snapshot.rebuild()
+        self.assertEqual(self.snapshot.lookup(30), [])
+        self.assertIs(self.snapshot.index, index)
+
+    def test_refresh(self):
+        """Rebuild the index in the background once it is stale"""
+        self.snapshot.start(self._build, self._load_source, 0.01)
+        built_at = self.snapshot.built_at
+        self.rows.append((5, 40, 103, 0, 1, 0.0))
+        time.sleep(0.02)
+        self.assertEqual(self.snapshot.lookup(40), [])
+        for _ in range(100):
+            if self.snapshot.built_at != built_at:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.builds, 2)
+        self.assertEqual(self.snapshot.index.lookup(40), [(5, 40, 103, 0, 1, 0.0)])
+
+    def test_stop(self):
+        """Stop serving from the snapshot"""
+        self.snapshot.start(self._build, self._load_source, 0)
+        self.snapshot.stop()
+        self.assertFalse(self.snapshot.enabled)
+        self.assertEqual(self.snapshot.stats()["rows"], 0)
@@ -0,0 +1,96 @@
+"""
+Test cases for the read-through LRU cache
+
+"""
+import time
+from unittest import TestCase
+from service.utils.cache import LRUCache
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(TestCase):
+    """ Test Cases for the LRU Cache """
+
+    def test_get_and_put(self):
+        """Store and retrieve a value"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get(1))
+        cache.put(1, ["a"])
+        self.assertEqual(cache.get(1), ["a"])
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_lru_eviction(self):
+        """Evict the least recently used entry when full"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.put(1, "a")
+        cache.put(2, "b")
+        cache.get(1)
+        cache.put(3, "c")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), "a")
+        self.assertEqual(cache.get(3), "c")
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl_expiry(self):
+        """Treat entries older than the TTL as missing"""
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.put(1, "a")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        """Remove specific keys"""
+        cache = LRUCache(maxsize=4, ttl=60)
+        cache.put(1, "a")
+        cache.put(2, "b")
+        cache.invalidate(1, 5)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2), "b")
+
+    def test_get_or_load(self):
+        """Fill a miss from the loader only once"""
+        cache = LRUCache(maxsize=4, ttl=60)
+        calls = []
+        loader = lambda: calls.append(1) or []
+        self.assertEqual(cache.get_or_load(1, loader), [])
+        self.assertEqual(cache.get_or_load(1, loader), [])
+        self.assertEqual(len(calls), 1)
+
+    def test_load_overlapping_invalidate(self):
+        """Do not store a value loaded while its key was invalidated"""
+        cache = LRUCache(maxsize=4, ttl=60)
+
+        def loader():
+            cache.invalidate(1)  # a write lands while the value is read
+            return "old"
+        self.assertEqual(cache.get_or_load(1, loader), "old")
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get_or_load(1, lambda: "new"), "new")
+        self.assertEqual(cache.get(1), "new")
+        generation = cache.generation(2)
+        cache.clear()
+        cache.put(2, "old", generation)
+        self.assertIsNone(cache.get(2))
+
+    def test_disabled(self):
+        """A cache with no room always calls the loader"""
+        cache = LRUCache(maxsize=0, ttl=60)
+        cache.put(1, "a")
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get_or_load(1, lambda: "b"), "b")
+
+    def test_stats(self):
+        """Report the counters"""
+        cache = LRUCache(maxsize=4, ttl=60)
+        cache.put(1, "a")
+        cache.get(1)
+        cache.get(2)
+        stats = cache.stats()
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
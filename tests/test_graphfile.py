@@ -0,0 +1,71 @@
+"""
+Test cases for the memory-mapped graph file
+
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from service.utils.graphfile import GraphFile, write_graph_file
+
+ROWS = [
+    (1, 10, 100, 0, 1, 0.5),
+    (4, 10, 101, 1, 0, 2.0),
+    (2, 20, 100, 2, 1, 0.0),
+    (3, 30, 102, 0, 1, 1.25),
+]
+
+
+######################################################################
+#  G R A P H   F I L E   T E S T   C A S E S
+######################################################################
+class TestGraphFile(TestCase):
+    """ Test Cases for the Graph File """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "graph.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        """Write a graph file and look up its rows"""
+        self.assertEqual(write_graph_file(self.path, ROWS, watermark=1234), 4)
+        graph = GraphFile(self.path)
+        self.assertEqual(len(graph), 4)
+        self.assertEqual(graph.watermark, 1234)
+        self.assertEqual(list(graph.sources), [10, 20, 30])
+        self.assertEqual(graph.lookup(10), ROWS[:2])
+        self.assertEqual(graph.lookup(30), ROWS[3:])
+        self.assertEqual(graph.lookup(25), [])
+        self.assertEqual(graph.nbytes, os.path.getsize(self.path))
+
+    def test_empty_graph(self):
+        """Write and read a graph file with no rows"""
+        write_graph_file(self.path, [])
+        graph = GraphFile(self.path)
+        self.assertEqual(len(graph), 0)
+        self.assertEqual(graph.watermark, 0)
+        self.assertEqual(graph.lookup(10), [])
+
+    def test_replace(self):
+        """Detect a new file moved into place"""
+        write_graph_file(self.path, ROWS)
+        graph = GraphFile(self.path)
+        self.assertFalse(graph.changed())
+        write_graph_file(self.path, ROWS[:1])
+        self.assertTrue(graph.changed())
+        self.assertEqual(len(graph), 4)  # the old mapping is still readable
+        self.assertEqual(len(GraphFile(self.path)), 1)
+        self.assertEqual(os.listdir(self.directory), ["graph.bin"])
+
+    def test_corrupt_file(self):
+        """Refuse files that are not graph files"""
+        write_graph_file(self.path, ROWS)
+        with open(self.path, "r+b") as graph:
+            graph.truncate(os.path.getsize(self.path) - 1)
+        self.assertRaises(ValueError, GraphFile, self.path)
+        with open(self.path, "wb") as graph:
+            graph.write(b"not a graph file at all!")
+        self.assertRaises(ValueError, GraphFile, self.path)
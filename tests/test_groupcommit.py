@@ -0,0 +1,85 @@
+"""
+Test cases for group commit of concurrent writes
+
+"""
+import threading
+from unittest import TestCase
+from service.utils.groupcommit import GroupCommit
+
+
+######################################################################
+#  G R O U P   C O M M I T   T E S T   C A S E S
+######################################################################
+class TestGroupCommit(TestCase):
+    """ Test Cases for Group Commit """
+
+    def setUp(self):
+        self.batches = []
+        self.committer = GroupCommit()
+
+    def write(self, items):
+        """Records a batch and doubles every item, failing on negative ones"""
+        self.batches.append(list(items))
+        return [ValueError(item) if item < 0 else 2 * item for item in items]
+
+    def submit_all(self, items):
+        """Submits every item from its own thread and returns the results by item"""
+        results = {}
+
+        def submit(item):
+            try:
+                results[item] = self.committer.submit(item)
+            except ValueError as error:
+                results[item] = error
+        threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_submit(self):
+        """Return the result of a single item"""
+        self.committer.configure(self.write, window_ms=0)
+        self.assertEqual(self.committer.submit(21), 42)
+        self.assertEqual(self.batches, [[21]])
+
+    def test_concurrent_items_share_batches(self):
+        """Write the items of concurrent callers together"""
+        self.committer.configure(self.write, window_ms=200, max_batch=10)
+        results = self.submit_all(range(1, 11))
+        self.assertEqual(results, {item: 2 * item for item in range(1, 11)})
+        self.assertLess(len(self.batches), 10)
+        self.assertEqual(sorted(item for batch in self.batches for item in batch), list(range(1, 11)))
+        stats = self.committer.stats()
+        self.assertEqual(stats["items"], 10)
+        self.assertEqual(stats["batches"], len(self.batches))
+
+    def test_max_batch(self):
+        """Never put more than max_batch items in one batch"""
+        self.committer.configure(self.write, window_ms=50, max_batch=3)
+        self.submit_all(range(1, 11))
+        self.assertTrue(all(len(batch) <= 3 for batch in self.batches))
+
+    def test_item_errors(self):
+        """Raise the error of a failed item in its own caller only"""
+        self.committer.configure(self.write, window_ms=100)
+        results = self.submit_all([1, -1, 2])
+        self.assertEqual(results[1], 2)
+        self.assertEqual(results[2], 4)
+        self.assertIsInstance(results[-1], ValueError)
+
+    def test_batch_errors(self):
+        """Raise the error of a failed batch in every caller"""
+        def broken(items):
+            raise ValueError("database is down")
+        self.committer.configure(broken, window_ms=100)
+        results = self.submit_all([1, 2, 3])
+        self.assertTrue(all(isinstance(result, ValueError) for result in results.values()))
+        self.assertEqual(self.committer.stats()["items"], 3)
+
+    def test_missing_results(self):
+        """Fail every item of a batch that did not get one result per item"""
+        self.committer.configure(lambda items: [], window_ms=0)
+        with self.assertRaises(RuntimeError):
+            self.committer.submit(1)
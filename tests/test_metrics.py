@@ -0,0 +1,71 @@
+"""
+Test cases for the Prometheus metrics
+
+"""
+import os
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+from unittest import TestCase
+from service import app
+from service.models import db
+
+# Sends n requests to the index page from a new process and prints /metrics
+CHILD = """
+import sys
+from service import app
+client = app.test_client()
+for _ in range(int(sys.argv[1])):
+    client.get("/")
+client.get("/api/recommendations")
+sys.stdout.write(client.get("/metrics").get_data(as_text=True))
+"""
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(TestCase):
+    """ Test Cases for the /metrics endpoint """
+
+    def setUp(self):
+        db.create_all()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_metrics(self):
+        """Report requests per route in the text exposition format"""
+        self.app.get("/recommendations/0")
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        body = resp.get_data(as_text=True)
+        self.assertIn(
+            'http_requests_total{method="GET",route="/recommendations/<int:id>",status="404"}', body
+        )
+        self.assertIn('http_request_duration_seconds_bucket{le="0.001",method="GET"', body)
+        self.assertIn('http_requests_in_progress{method="GET",route="/metrics"} 1.0', body)
+
+    def test_metrics_restx_routes(self):
+        """Label Flask-RESTX resources with their URL rule"""
+        self.app.get("/api/recommendations/0")
+        body = self.app.get("/metrics").get_data(as_text=True)
+        self.assertIn('route="/api/recommendations/<recommendation_id>",status="404"', body)
+
+    def test_metrics_multiprocess(self):
+        """Add up the metrics of several worker processes"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+        for count in ("2", "3"):
+            subprocess.run([sys.executable, "-c", CHILD, count], env=env, check=True, capture_output=True)
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, "0"], env=env, check=True, capture_output=True, text=True
+        ).stdout
+        self.assertIn('http_requests_total{method="GET",route="/",status="200"} 5.0', output)
+        pool_sizes = re.findall(r'^db_pool_size\{pid="(\d+)"\} 2.0$', output, re.M)
+        self.assertEqual(len(set(pool_sizes)), 3)
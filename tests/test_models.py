@@ -3,10 +3,18 @@ Test cases for Recommendation Model
 
 """
 import os
+import time
 import logging
+import threading
+import tempfile
+import json
 import unittest
 from werkzeug.exceptions import NotFound
-from service.models import Recommendation, Type, Status, DataValidationError, db
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from service.models import (
+    Recommendation, Type, Status, DataValidationError, db, src_cache, src_snapshot, schema_version, group_commit,
+)
 from service import app
 from .factories import RecommendationFactory
 
@@ -39,6 +47,7 @@ class TestRecommendationModel(unittest.TestCase):
         """This runs before each test"""
         db.drop_all()  # clean up the last tests
         db.create_all()  # make our sqlalchemy tables
+        src_cache.clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -252,3 +261,509 @@ class TestRecommendationModel(unittest.TestCase):
         self.assertEqual(recommendation[0].id, 1)
         self.assertEqual(recommendation[0].src_product_id, 100)
         self.assertEqual(recommendation[0].type,Type.UP_SELL)
+
+    def test_find_by_src_id_cached(self):
+        """Find Recommendations by Source ID through the cache"""
+        Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        recommendations = Recommendation.find_by_src_id_cached(100)
+        self.assertEqual(len(recommendations), 1)
+        self.assertEqual(recommendations[0]["rec_product_id"], 200)
+        self.assertEqual(src_cache.misses, 1)
+        recommendations = Recommendation.find_by_src_id_cached(100)
+        self.assertEqual(len(recommendations), 1)
+        self.assertEqual(src_cache.hits, 1)
+
+    def test_cache_invalidated_on_create(self):
+        """Creating a Recommendation invalidates its source product"""
+        self.assertEqual(Recommendation.find_by_src_id_cached(100), [])
+        Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        self.assertEqual(len(Recommendation.find_by_src_id_cached(100)), 1)
+
+    def test_cache_invalidated_on_update(self):
+        """Moving a Recommendation invalidates the old and new source products"""
+        recommendation = Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED")
+        recommendation.create()
+        self.assertEqual(len(Recommendation.find_by_src_id_cached(100)), 1)
+        self.assertEqual(Recommendation.find_by_src_id_cached(300), [])
+        recommendation.src_product_id = 300
+        recommendation.update()
+        self.assertEqual(Recommendation.find_by_src_id_cached(100), [])
+        self.assertEqual(len(Recommendation.find_by_src_id_cached(300)), 1)
+
+    def test_cache_invalidated_on_delete(self):
+        """Deleting a Recommendation invalidates its source product"""
+        recommendation = Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED")
+        recommendation.create()
+        self.assertEqual(len(Recommendation.find_by_src_id_cached(100)), 1)
+        recommendation.delete()
+        self.assertEqual(Recommendation.find_by_src_id_cached(100), [])
+
+    def test_find_page(self):
+        """Page through Recommendations by id"""
+        for recommendation in RecommendationFactory.create_batch(5):
+            recommendation.create()
+        page, next_cursor = Recommendation.find_page(Recommendation.query, 2)
+        self.assertEqual([rec.id for rec in page], [1, 2])
+        self.assertEqual(next_cursor, 2)
+        page, next_cursor = Recommendation.find_page(Recommendation.query, 2, next_cursor)
+        self.assertEqual([rec.id for rec in page], [3, 4])
+        page, next_cursor = Recommendation.find_page(Recommendation.query, 2, next_cursor)
+        self.assertEqual([rec.id for rec in page], [5])
+        self.assertIsNone(next_cursor)
+
+    def test_bulk_create(self):
+        """Create many Recommendations in one transaction"""
+        recommendations = RecommendationFactory.create_batch(5)
+        ids = Recommendation.bulk_create(recommendations, batch_size=2)
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+        self.assertEqual([rec.id for rec in recommendations], ids)
+        self.assertEqual(len(Recommendation.all()), 5)
+        found = Recommendation.find(3)
+        self.assertEqual(found.src_product_id, recommendations[2].src_product_id)
+        self.assertEqual(found.type, recommendations[2].type)
+        self.assertEqual(Recommendation.bulk_create([]), [])
+
+    def test_bulk_create_with_bad_rows(self):
+        """Fail only the rows that cannot be written and keep the rest of the batch"""
+        recommendations = RecommendationFactory.create_batch(5)
+        recommendations[1].rec_product_id = 2 ** 40  # out of range for an integer column
+        results = Recommendation.bulk_create(recommendations, batch_size=2)
+        self.assertIsInstance(results[1], DBAPIError)
+        self.assertEqual(len(Recommendation.all()), 4)
+        self.assertIsNone(recommendations[1].id)
+        for recommendation, result in zip(recommendations, results):
+            if recommendation is not recommendations[1]:
+                self.assertEqual(recommendation.id, result)
+                self.assertIsNotNone(Recommendation.find(result))
+
+    def test_deserialize_out_of_range_id(self):
+        """Test deserialization of ids that do not fit an integer column"""
+        data = RecommendationFactory().serialize()
+        for name in ("src_product_id", "rec_product_id"):
+            for value in (2 ** 31, -2 ** 31 - 1):
+                self.assertRaises(DataValidationError, Recommendation().deserialize, dict(data, **{name: value}))
+        self.assertEqual(Recommendation().deserialize(dict(data, src_product_id=2 ** 31 - 1)).src_product_id, 2 ** 31 - 1)
+
+    def test_find_by_src_ids_cached(self):
+        """Find Recommendations for several Source IDs at once"""
+        Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=100, rec_product_id=201, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=101, rec_product_id=202, type="UP_SELL", status="ENABLED").create()
+        Recommendation.find_by_src_id_cached(101)
+        results = Recommendation.find_by_src_ids_cached([100, 101, 102])
+        self.assertEqual(len(results[100]), 2)
+        self.assertEqual(results[101][0]["rec_product_id"], 202)
+        self.assertEqual(results[102], [])
+        self.assertEqual(src_cache.hits, 1)
+        self.assertEqual(Recommendation.find_by_src_id_cached(102), [])
+        self.assertEqual(src_cache.hits, 2)
+
+    def _explain(self, query):
+        """Returns the query plan of a query when sequential scans are discouraged"""
+        sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = "\n".join(row[0] for row in db.session.execute(text("EXPLAIN " + sql)))
+        db.session.rollback()
+        return plan
+
+    def test_find_by_src_id_uses_index(self):
+        """Look up by Source ID through the composite index"""
+        # either index leading with src_product_id serves the lookup
+        plan = self._explain(Recommendation.find_by_src_id(100))
+        self.assertRegex(plan, "ix_recommendation_src_(status_type|score)")
+        plan = self._explain(Recommendation.find_by_src_ids([100, 101]))
+        self.assertRegex(plan, "ix_recommendation_src_(status_type|score)")
+
+    def test_find_by_rec_id_uses_index(self):
+        """Look up by Recommendation product ID through its index"""
+        plan = self._explain(Recommendation.find_by_rec_id(200))
+        self.assertIn("ix_recommendation_rec_product_id", plan)
+
+    def test_create_indexes(self):
+        """Create missing indexes on an existing table"""
+        db.session.execute(text("DROP INDEX ix_recommendation_rec_product_id"))
+        db.session.commit()
+        Recommendation.create_indexes()
+        Recommendation.create_indexes()  # a second run is a no-op
+        names = [row[0] for row in db.session.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = 'recommendation'")
+        )]
+        self.assertIn("ix_recommendation_rec_product_id", names)
+        self.assertIn("ix_recommendation_src_status_type", names)
+
+    def test_find_by_filters(self):
+        """Find Recommendations matching several filters"""
+        Recommendation(src_product_id=42, rec_product_id=200, type="CROSS_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=42, rec_product_id=201, type="CROSS_SELL", status="DISABLED").create()
+        Recommendation(src_product_id=42, rec_product_id=202, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=43, rec_product_id=200, type="CROSS_SELL", status="ENABLED").create()
+        found = Recommendation.find_by_filters(src_product_id=42, type="CROSS_SELL", status=Status.ENABLED).all()
+        self.assertEqual([rec.rec_product_id for rec in found], [200])
+        found = Recommendation.find_by_filters(src_product_id=[42, 43], rec_product_id=200).all()
+        self.assertEqual(len(found), 2)
+        self.assertEqual(Recommendation.find_by_filters().count(), 4)
+        grouped = Recommendation.find_grouped_by_src([42, 43, 44], type="UP_SELL")
+        self.assertEqual(len(grouped[42]), 1)
+        self.assertEqual(grouped[43], [])
+        self.assertEqual(grouped[44], [])
+        self.assertRaises(DataValidationError, Recommendation.find_by_filters, type="bogus")
+
+    def test_update_by_id(self):
+        """Update a Recommendation in place by id"""
+        recommendation = Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED")
+        recommendation.create()
+        self.assertEqual(len(Recommendation.find_by_src_id_cached(100)), 1)
+        data = Recommendation.update_by_id(recommendation.id, src_product_id=300, status=Status.DISABLED)
+        self.assertEqual(data["id"], recommendation.id)
+        self.assertEqual(data["src_product_id"], 300)
+        self.assertEqual(data["rec_product_id"], 200)
+        self.assertEqual(data["type"], "UP_SELL")
+        self.assertEqual(data["status"], "DISABLED")
+        self.assertEqual(Recommendation.find(recommendation.id).src_product_id, 300)
+        self.assertEqual(Recommendation.find_by_src_id_cached(100), [])
+        self.assertIsNone(Recommendation.update_by_id(0, status=Status.ENABLED))
+
+    def test_delete_by_id(self):
+        """Delete a Recommendation in place by id"""
+        recommendation = Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED")
+        recommendation.create()
+        self.assertEqual(len(Recommendation.find_by_src_id_cached(100)), 1)
+        recommendation_id = recommendation.id
+        self.assertTrue(Recommendation.delete_by_id(recommendation_id))
+        self.assertEqual(len(Recommendation.all()), 0)
+        self.assertEqual(Recommendation.find_by_src_id_cached(100), [])
+        self.assertFalse(Recommendation.delete_by_id(recommendation_id))
+
+    def test_delete_by_filters(self):
+        """Delete every Recommendation of a source product"""
+        Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=100, rec_product_id=201, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=101, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        self.assertEqual(len(Recommendation.find_by_src_id_cached(100)), 2)
+        self.assertEqual(Recommendation.delete_by_filters(src_product_id=100), 2)
+        self.assertEqual(Recommendation.find_by_src_id_cached(100), [])
+        self.assertEqual(len(Recommendation.find_by_src_id_cached(101)), 1)
+        self.assertEqual(Recommendation.delete_by_filters(rec_product_id=200), 1)
+        self.assertEqual(Recommendation.find_by_src_id_cached(101), [])
+
+    def test_update_by_filters(self):
+        """Disable every Recommendation of a recommended product"""
+        Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=101, rec_product_id=200, type="CROSS_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=101, rec_product_id=201, type="UP_SELL", status="ENABLED").create()
+        self.assertEqual(Recommendation.find_by_src_id_cached(100)[0]["status"], "ENABLED")
+        count = Recommendation.update_by_filters({"status": Status.DISABLED}, rec_product_id=200)
+        self.assertEqual(count, 2)
+        self.assertEqual(Recommendation.find_by_src_id_cached(100)[0]["status"], "DISABLED")
+        self.assertEqual(Recommendation.find_by_filters(status="DISABLED").count(), 2)
+        count = Recommendation.update_by_filters({"status": Status.ENABLED}, type="UP_SELL", src_product_id=101)
+        self.assertEqual(count, 1)
+
+    def test_find_by_src_id_from_snapshot(self):
+        """Find Recommendations by Source ID in the in-memory snapshot"""
+        Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=101, rec_product_id=201, type="ACCESSORY", status="DISABLED").create()
+        Recommendation.start_snapshot(app)
+        try:
+            self.assertEqual(len(src_snapshot.index), 2)
+            recommendations = Recommendation.find_by_src_id_cached(101)
+            self.assertEqual(recommendations, [
+                {
+                    "id": 2, "src_product_id": 101, "rec_product_id": 201,
+                    "type": "ACCESSORY", "status": "DISABLED", "score": 0.0,
+                }
+            ])
+            Recommendation(src_product_id=101, rec_product_id=202, type="UP_SELL", status="ENABLED").create()
+            self.assertEqual(len(Recommendation.find_by_src_id_cached(101)), 2)
+            results = Recommendation.find_by_src_ids_cached([100, 102])
+            self.assertEqual(len(results[100]), 1)
+            self.assertEqual(results[102], [])
+            self.assertEqual(src_cache.misses, 0)
+        finally:
+            src_snapshot.stop()
+
+    def test_find_by_src_id_from_graph_file(self):
+        """Find Recommendations by Source ID in an exported graph file"""
+        Recommendation(src_product_id=100, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=101, rec_product_id=201, type="ACCESSORY", status="DISABLED").create()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph.bin")
+            self.assertEqual(Recommendation.export_graph(path), 2)
+            app.config["ADJACENCY_GRAPH_FILE"] = path
+            try:
+                Recommendation.start_snapshot(app)
+                recommendations = Recommendation.find_by_src_id_cached(101)
+                self.assertEqual(recommendations[0]["rec_product_id"], 201)
+                self.assertEqual(recommendations[0]["type"], "ACCESSORY")
+                # a local write is visible before the next export
+                Recommendation(src_product_id=100, rec_product_id=202, type="UP_SELL", status="ENABLED").create()
+                src_snapshot.rebuild()
+                self.assertEqual(len(Recommendation.find_by_src_id_cached(100)), 2)
+            finally:
+                app.config["ADJACENCY_GRAPH_FILE"] = None
+                src_snapshot.stop()
+
+    def test_graph_file_catches_up(self):
+        """Reload the sources written since a graph file was exported"""
+        Recommendation(src_product_id=7, rec_product_id=200, type="UP_SELL", status="ENABLED").create()
+        Recommendation(src_product_id=8, rec_product_id=201, type="ACCESSORY", status="ENABLED").create()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph.bin")
+            Recommendation.export_graph(path)
+            # written while no snapshot was running, e.g. before a restart
+            Recommendation.update_by_filters({"status": Status.DISABLED}, src_product_id=7)
+            app.config["ADJACENCY_GRAPH_FILE"] = path
+            try:
+                Recommendation.start_snapshot(app)
+                self.assertEqual(Recommendation.find_by_src_id_cached(7)[0]["status"], "DISABLED")
+                self.assertEqual(Recommendation.find_by_src_id_cached(8)[0]["status"], "ENABLED")
+                # written by another process, which does not invalidate this snapshot
+                with db.engine.begin() as conn:
+                    conn.execute(text("UPDATE recommendation SET score = 2.5 WHERE src_product_id = 8"))
+                src_snapshot.rebuild()
+                self.assertEqual(Recommendation.find_by_src_id_cached(8)[0]["score"], 2.5)
+                # a new export is swapped in with the writes made after it
+                Recommendation.export_graph(path)
+                with db.engine.begin() as conn:
+                    conn.execute(text("DELETE FROM recommendation WHERE src_product_id = 7"))
+                src_snapshot.rebuild()
+                self.assertEqual(Recommendation.find_by_src_id_cached(7), [])
+                self.assertEqual(Recommendation.find_by_src_id_cached(8)[0]["score"], 2.5)
+            finally:
+                app.config["ADJACENCY_GRAPH_FILE"] = None
+                src_snapshot.stop()
+
+    def test_find_rows_page(self):
+        """Page through Recommendations as plain rows"""
+        recommendations = RecommendationFactory.create_batch(5)
+        for recommendation in recommendations:
+            recommendation.create()
+        rows, next_cursor = Recommendation.find_rows_page(3)
+        self.assertEqual([row[0] for row in rows], [1, 2, 3])
+        self.assertEqual(next_cursor, 3)
+        rows, next_cursor = Recommendation.find_rows_page(3, next_cursor)
+        self.assertEqual([row[0] for row in rows], [4, 5])
+        self.assertIsNone(next_cursor)
+        test = recommendations[0]
+        rows, _ = Recommendation.find_rows_page(10, src_product_id=test.src_product_id, type=test.type)
+        self.assertIn(test.id, [row[0] for row in rows])
+
+    def test_serialize_rows_json(self):
+        """Serialize plain rows the same way as Recommendations"""
+        for recommendation in RecommendationFactory.create_batch(3):
+            recommendation.create()
+        rows, _ = Recommendation.find_rows_page(10)
+        data = [json.loads(line) for line in Recommendation.serialize_rows_json(rows)]
+        self.assertEqual(data, [rec.serialize() for rec in Recommendation.find_by_filters().order_by(Recommendation.id)])
+
+    def test_stream_rows(self):
+        """Stream Recommendations as batches of plain rows"""
+        for recommendation in RecommendationFactory.create_batch(5):
+            recommendation.create()
+        batches = list(Recommendation.stream_rows(2))
+        self.assertEqual([len(rows) for rows in batches], [2, 2, 1])
+        self.assertEqual([row[0] for rows in batches for row in rows], [1, 2, 3, 4, 5])
+
+    def test_after_fork(self):
+        """Give a forked worker its own connections and leave the parent's open"""
+        recommendation = RecommendationFactory()
+        recommendation.create()
+        db.session.remove()  # the parent's connection is now in the pool
+        pid = os.fork()
+        if pid == 0:
+            try:
+                Recommendation.after_fork()
+                found = Recommendation.find_row(recommendation.id)
+                os._exit(0 if found is not None and found[0] == recommendation.id else 1)
+            except Exception:  # pylint: disable=broad-except
+                os._exit(2)
+        _, code = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(code), 0)
+        self.assertIsNotNone(Recommendation.find_row(recommendation.id))
+
+    def test_ensure_schema(self):
+        """Create and stamp the tables only when the schema version stamp is not current"""
+        version = Recommendation.schema_fingerprint()
+        db.drop_all()
+        Recommendation.ensure_schema()
+        with db.engine.connect() as conn:
+            self.assertEqual(conn.execute(schema_version.select()).fetchall(), [(version,)])
+        recommendation = RecommendationFactory()
+        recommendation.create()
+        db.session.remove()
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", record)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", record)
+        Recommendation.ensure_schema()
+        self.assertEqual(len(statements), 1)
+        with db.engine.begin() as conn:
+            conn.execute(schema_version.update().values(version="old"))
+        Recommendation.ensure_schema()
+        with db.engine.connect() as conn:
+            self.assertEqual(conn.execute(schema_version.select()).fetchall(), [(version,)])
+        self.assertIsNotNone(Recommendation.find(recommendation.id))
+
+    def test_concurrent_reads_share_a_query(self):
+        """Run one query for concurrent identical lookups"""
+        recommendation = RecommendationFactory()
+        recommendation.create()
+        db.session.remove()
+        statements = []
+
+        def slow_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+            time.sleep(0.2)
+        event.listen(db.engine, "before_cursor_execute", slow_statement)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", slow_statement)
+        results = []
+
+        def lookup():
+            with app.app_context():
+                try:
+                    results.append(Recommendation.find_row(recommendation.id))
+                finally:
+                    db.session.remove()
+        threads = [threading.Thread(target=lookup) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([row[0] for row in results], [recommendation.id] * 5)
+
+    def test_insert_rows(self):
+        """Insert a batch of rows and fail only the rows that cannot be written"""
+        rows = [rec.column_values() for rec in RecommendationFactory.create_batch(3)]
+        ids = Recommendation.insert_rows(db.engine, rows)
+        self.assertEqual(len(Recommendation.all()), 3)
+        bad = dict(rows[0], rec_product_id=2 ** 40)  # out of range for an integer column
+        results = Recommendation.insert_rows(db.engine, [rows[1], bad, rows[2]])
+        self.assertIsInstance(results[1], DBAPIError)
+        self.assertEqual(len(set(ids + [results[0], results[2]])), 5)
+        self.assertEqual(len(Recommendation.all()), 5)
+        self.assertIsInstance(Recommendation.insert_rows(db.engine, [bad])[0], DBAPIError)
+
+    def test_create_grouped(self):
+        """Create a Recommendation through the group commit writer"""
+        engine = db.engine
+        group_commit.configure(lambda rows: Recommendation.insert_rows(engine, rows), window_ms=0)
+        self.addCleanup(group_commit.configure, None, enabled=False)
+        recommendation = RecommendationFactory()
+        src_cache.put(recommendation.src_product_id, [])
+        recommendation.create_grouped()
+        self.assertIsNotNone(recommendation.id)
+        self.assertIsNone(src_cache.get(recommendation.src_product_id))
+        found = Recommendation.find(recommendation.id)
+        self.assertEqual(found.serialize(), recommendation.serialize())
+
+    def test_deserialize_bad_score(self):
+        """Test deserialization of a score that is not a finite number"""
+        data = RecommendationFactory().serialize()
+        for score in ("0.5", True, float("nan"), float("inf"), None):
+            data["score"] = score
+            self.assertRaises(DataValidationError, Recommendation().deserialize, data)
+        del data["score"]
+        recommendation = Recommendation(score=0.75).deserialize(data)
+        self.assertEqual(recommendation.score, 0.75)  # kept when not given
+        self.assertEqual(Recommendation().deserialize(dict(data, score=2)).score, 2.0)
+
+    def test_find_top_rows(self):
+        """Find the highest scored Recommendations in score order"""
+        for rec_product_id, score in ((1, 0.5), (2, 0.9), (3, 0.1), (4, 0.9)):
+            Recommendation(
+                src_product_id=100, rec_product_id=rec_product_id, type=Type.UP_SELL, status=Status.ENABLED, score=score
+            ).create()
+        Recommendation(src_product_id=101, rec_product_id=5, type=Type.UP_SELL, status=Status.ENABLED, score=5.0).create()
+        rows = Recommendation.find_top_rows(3, src_product_id=100)
+        self.assertEqual([(row.rec_product_id, row.score) for row in rows], [(2, 0.9), (4, 0.9), (1, 0.5)])
+        self.assertEqual(Recommendation.find_top_rows(1)[0].rec_product_id, 5)
+        self.assertEqual(Recommendation.find_top_rows(5, src_product_id=100, rec_product_id=3)[0].score, 0.1)
+
+    def test_find_top_rows_uses_index(self):
+        """Read the top Recommendations of a source from the score index without sorting"""
+        query = Recommendation._top_select({"src_product_id": 100}).limit(5)
+        sql = str(query.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        db.session.execute(text("SET LOCAL enable_bitmapscan = off"))  # an empty table favours bitmap scans
+        plan = "\n".join(row[0] for row in db.session.execute(text("EXPLAIN " + sql)))
+        db.session.rollback()
+        self.assertIn("ix_recommendation_src_score", plan)
+        self.assertNotIn("Sort", plan)
+
+    def test_find_top_by_src_id_cached(self):
+        """Rank the cached Recommendations of a source, or read only the top ones on a miss"""
+        for rec_product_id, score in ((1, 0.2), (2, 0.8), (3, 0.5)):
+            Recommendation(
+                src_product_id=100, rec_product_id=rec_product_id, type=Type.UP_SELL, status=Status.ENABLED, score=score
+            ).create()
+        top = Recommendation.find_top_by_src_id_cached(100, 2)
+        self.assertEqual([rec["rec_product_id"] for rec in top], [2, 3])
+        self.assertIsNone(src_cache.get(100))  # a miss does not load the whole source
+        Recommendation.find_by_src_id_cached(100)
+        self.assertEqual(Recommendation.find_top_by_src_id_cached(100, 2), top)
+        self.assertEqual(src_cache.hits, 1)
+
+    def test_add_missing_columns(self):
+        """Add the score column to a table created before it existed"""
+        RecommendationFactory().create()
+        db.session.commit()
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE recommendation DROP COLUMN score"))
+        Recommendation.add_missing_columns()
+        self.assertEqual(Recommendation.all()[0].score, 0.0)
+        Recommendation.add_missing_columns()  # nothing left to add
+
+    def test_add_missing_columns_concurrently(self):
+        """Let instances that start at the same time all add the missing column"""
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE recommendation DROP COLUMN score"))
+        db.session.remove()
+        barrier = threading.Barrier(4)
+        errors = []
+
+        def add():
+            with app.app_context():
+                barrier.wait(5)
+                try:
+                    Recommendation.add_missing_columns()
+                except Exception as error:  # pylint: disable=broad-except
+                    errors.append(error)
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(errors, [])
+        RecommendationFactory(score=None).create()
+        self.assertEqual(Recommendation.all()[0].score, 0.0)
+
+    def test_cached_lookup_overlapping_a_write(self):
+        """Do not cache rows of a source that were read before a concurrent write"""
+        recommendation = Recommendation(src_product_id=5, rec_product_id=6, type=Type.UP_SELL, status=Status.ENABLED)
+        recommendation.create()
+        db.session.remove()
+        read, release = threading.Event(), threading.Event()
+
+        def hold_source_read(conn, cursor, statement, *args):
+            if threading.current_thread() is not threading.main_thread() and "src_product_id" in statement:
+                read.set()
+                release.wait(5)
+        event.listen(db.engine, "after_cursor_execute", hold_source_read)
+        self.addCleanup(event.remove, db.engine, "after_cursor_execute", hold_source_read)
+        results = []
+
+        def lookup():
+            with app.app_context():
+                try:
+                    results.append(Recommendation.find_by_src_id_cached(5))
+                finally:
+                    db.session.remove()
+        thread = threading.Thread(target=lookup)
+        thread.start()
+        self.assertTrue(read.wait(5))
+        Recommendation.update_by_id(recommendation.id, status=Status.DISABLED)  # commits and invalidates
+        release.set()
+        thread.join(5)
+        self.assertEqual(results[0][0]["status"], "ENABLED")  # read before the write
+        self.assertEqual(Recommendation.find_by_src_id_cached(5)[0]["status"], "DISABLED")
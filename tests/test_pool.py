@@ -0,0 +1,96 @@
+"""
+Test cases for the connection pool instrumentation
+
+"""
+from unittest import TestCase
+from sqlalchemy import create_engine, exc
+from prometheus_client import REGISTRY
+from service.utils.pool import PoolMonitor
+
+
+######################################################################
+#  P O O L   M O N I T O R   T E S T   C A S E S
+######################################################################
+class TestPoolMonitor(TestCase):
+    """ Test Cases for the Pool Monitor """
+
+    def setUp(self):
+        self.monitor = PoolMonitor()
+        self.engine = create_engine(
+            "sqlite://",
+            poolclass=self.monitor.queue_pool_class(),
+            pool_size=1,
+            max_overflow=1,
+            pool_timeout=0.01,
+        )
+        self.monitor.attach(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_checkouts(self):
+        """Count checkouts and connections"""
+        with self.engine.connect():
+            stats = self.monitor.stats()
+            self.assertEqual(stats["in_use"], 1)
+        with self.engine.connect():
+            pass
+        stats = self.monitor.stats()
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["idle"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["connects"], 1)
+        self.assertEqual(stats["overflows"], 0)
+
+    def test_gauges(self):
+        """Keep the Prometheus gauges in step with the pool"""
+        gauge = lambda name: REGISTRY.get_sample_value(name)
+        with self.engine.connect():
+            self.assertEqual(gauge("db_pool_connections_in_use"), 1)
+            self.assertEqual(gauge("db_pool_connections_idle"), 0)
+        self.assertEqual(gauge("db_pool_connections_in_use"), 0)
+        self.assertEqual(gauge("db_pool_connections_idle"), 1)
+        self.assertEqual(gauge("db_pool_size"), 1)
+        self.assertEqual(gauge("db_pool_checkouts"), 1)
+        self.assertEqual(gauge("db_pool_connects"), 1)
+        self.assertEqual(gauge("db_pool_waits"), 1)
+        self.monitor.clear()
+        self.assertEqual(gauge("db_pool_checkouts"), 0)
+
+    def test_overflow_and_timeout(self):
+        """Count overflow connections and checkouts that timed out"""
+        first = self.engine.connect()
+        second = self.engine.connect()
+        self.assertEqual(self.monitor.stats()["overflow"], 1)
+        self.assertRaises(exc.TimeoutError, self.engine.connect)
+        first.close()
+        second.close()
+        stats = self.monitor.stats()
+        self.assertEqual(stats["overflows"], 1)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_overflow"), 0)  # closed, the pool holds one
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_timeouts"), 1)
+        self.assertGreaterEqual(stats["wait_ms_max"], 10)
+
+    def test_attach_twice(self):
+        """Count each event once when attached again"""
+        self.monitor.attach(self.engine)
+        with self.engine.connect():
+            pass
+        self.assertEqual(self.monitor.stats()["checkouts"], 1)
+
+    def test_survives_dispose(self):
+        """Keep counting after the pool is recreated"""
+        self.engine.dispose()
+        with self.engine.connect():
+            self.assertEqual(self.monitor.stats()["in_use"], 1)
+        self.assertEqual(self.monitor.stats()["checkouts"], 1)
+
+    def test_clear(self):
+        """Reset the counters"""
+        with self.engine.connect():
+            pass
+        self.monitor.clear()
+        self.assertEqual(self.monitor.stats()["checkouts"], 0)
+        self.assertEqual(PoolMonitor().stats()["size"], None)
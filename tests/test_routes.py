@@ -6,11 +6,15 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import sys
+import json
 import logging
+import subprocess
+from sqlalchemy import text
 from unittest import TestCase
 from service.utils import status  # HTTP Status Codes
-from service.models import db
-from service.routes import app, init_db
+from service.models import Recommendation, db, group_commit, src_cache, src_versions
+from service.routes import api, app, init_db
 from .factories import RecommendationFactory
 
 # DATABASE_URI = os.getenv('DATABASE_URI', 'sqlite:///../db/test.db')
@@ -45,6 +49,8 @@ class TestRecommendationServer(TestCase):
         """Runs before each test"""
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
+        src_cache.clear()
+        src_versions.clear()
         self.app = app.test_client()
 
     def tearDown(self):
@@ -128,6 +134,22 @@ class TestRecommendationServer(TestCase):
             new_recommendation["type"], test_recommendation.type.name, "Type do not match"
         )
 
+    def test_create_recommendation_with_group_commit(self):
+        """Create recommendations through the group commit writer"""
+        engine = db.engine
+        group_commit.configure(lambda rows: Recommendation.insert_rows(engine, rows), window_ms=0)
+        group_commit.clear()
+        self.addCleanup(group_commit.configure, None, enabled=False)
+        for url in (BASE_URL, BASE_API):
+            test_recommendation = RecommendationFactory()
+            resp = self.app.post(url, json=test_recommendation.serialize(), content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            new_recommendation = resp.get_json()
+            resp = self.app.get(resp.headers["Location"])
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json(), new_recommendation)
+        self.assertEqual(group_commit.stats()["items"], 2)
+
     def test_create_recommendation_no_data(self):
         """Create a recommendation with missing data"""
         resp = self.app.post(BASE_URL, json={}, content_type=CONTENT_TYPE_JSON)
@@ -303,6 +325,9 @@ class TestRecommendationServer(TestCase):
                             
             content_type=CONTENT_TYPE_JSON)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # PUT returns the same shape as GET, with no internal _id
+        self.assertEqual(resp.get_json(), self.app.get(f'{BASE_API}/{id}').get_json())
+        self.assertNotIn('"_id"', self.app.get("/api/swagger.json").get_data(as_text=True))
 
     def test_get_recommendations_list_API(self):
         """Get a list of recommendations"""
@@ -367,3 +392,404 @@ class TestRecommendationServer(TestCase):
         enabled = resp.get_json()
         self.assertEqual(enabled["status"], "ENABLED")
 
+    def test_disable_invalidates_cache(self):
+        """Disabling a recommendation is visible to cached source lookups"""
+        recommendation = self._create_recommendations(1)[0]
+        query = "src_product_id={}".format(recommendation.src_product_id)
+        resp = self.app.get(BASE_URL, query_string=query)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = recommendation.serialize()
+        data["status"] = "ENABLED"
+        resp = self.app.put(
+            "{0}/{1}/disable".format(BASE_URL, recommendation.id),
+            json=data,
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(BASE_URL, query_string=query)
+        self.assertEqual(resp.get_json()[0]["status"], "DISABLED")
+
+    def test_conditional_get_by_source(self):
+        """Answer an unchanged source lookup with 304 Not Modified"""
+        recommendation = self._create_recommendations(1)[0]
+        query = "src_product_id={}".format(recommendation.src_product_id)
+        resp = self.app.get(BASE_URL, query_string=query)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(BASE_URL, query_string=query, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.data, b"")
+        # a cached lookup is not needed to answer
+        self.assertEqual(src_cache.stats()["hits"], 0)
+        resp = self.app.put("{0}/{1}/disable".format(BASE_URL, recommendation.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(BASE_URL, query_string=query, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.get_json()[0]["status"], "DISABLED")
+
+    def test_conditional_get_recommendation(self):
+        """Answer an unchanged single recommendation with 304 Not Modified"""
+        recommendation = self._create_recommendations(1)[0]
+        for url in ("{0}/{1}".format(BASE_URL, recommendation.id), "{0}/{1}".format(BASE_API, recommendation.id)):
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            etag = resp.headers["ETag"]
+            resp = self.app.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        action = "enable" if recommendation.status.name == "DISABLED" else "disable"
+        resp = self.app.put("{0}/{1}/{2}".format(BASE_URL, recommendation.id, action))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_conditional_get_filtered_list(self):
+        """Answer an unchanged filtered listing with 304 Not Modified"""
+        recommendation = self._create_recommendations(3)[0]
+        query = "rec_product_id={}".format(recommendation.rec_product_id)
+        resp = self.app.get(BASE_URL, query_string=query)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(BASE_URL, query_string=query, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_stats(self):
+        """Get the cache statistics"""
+        recommendation = self._create_recommendations(1)[0]
+        query = "src_product_id={}".format(recommendation.src_product_id)
+        self.app.get(BASE_URL, query_string=query)
+        self.app.get(BASE_URL, query_string=query)
+        resp = self.app.get("/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["cache"]["misses"], 1)
+        self.assertEqual(data["cache"]["hits"], 1)
+
+    def test_get_pool_stats(self):
+        """Get the connection pool counters"""
+        self._create_recommendations(1)
+        resp = self.app.get("/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        pool = resp.get_json()["pool"]
+        self.assertEqual(pool["size"], app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"])
+        self.assertGreater(pool["checkouts"], 0)
+        self.assertEqual(pool["timeouts"], 0)
+        self.assertIn("wait_ms_max", pool)
+
+    def test_list_recommendations_paginated(self):
+        """Page through the list of recommendations with a cursor"""
+        self._create_recommendations(5)
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([rec["id"] for rec in resp.get_json()], [1, 2])
+        self.assertIn("after=2", resp.headers["Link"])
+        resp = self.app.get(BASE_URL, query_string="limit=2&after=4")
+        self.assertEqual([rec["id"] for rec in resp.get_json()], [5])
+        self.assertNotIn("Link", resp.headers)
+
+    def test_list_recommendations_paginated_by_source(self):
+        """Page through the recommendations of one source product"""
+        for rec_product_id in range(3):
+            self.app.post(BASE_URL, json={
+                "src_product_id": 7, "rec_product_id": rec_product_id,
+                "type": "UP_SELL", "status": "ENABLED"
+            }, content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get(BASE_URL, query_string="src_product_id=7&limit=2")
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn("src_product_id=7", resp.headers["Link"])
+        resp = self.app.get(BASE_URL, query_string="src_product_id=7&limit=2&after=2")
+        self.assertEqual([rec["id"] for rec in resp.get_json()], [3])
+
+    def test_list_recommendations_bad_page(self):
+        """Reject an invalid page size"""
+        resp = self.app.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL, query_string="after=abc")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_recommendations_paginated_API(self):
+        """Page through the list of recommendations with a cursor on the API"""
+        self._create_recommendations(3)
+        resp = self.app.get(BASE_API, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn('rel="next"', resp.headers["Link"])
+        resp = self.app.get(BASE_API, query_string="limit=2&after=2")
+        self.assertEqual([rec["id"] for rec in resp.get_json()], [3])
+
+    def test_get_recommendation_API(self):
+        """Get a single recommendation from the API"""
+        test_recommendation = self._create_recommendations(1)[0]
+        resp = self.app.get("{0}/{1}".format(BASE_API, test_recommendation.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), test_recommendation.serialize())
+
+    def test_get_recommendations_with_fields_mask_API(self):
+        """Apply an X-Fields mask to the API responses"""
+        test_recommendation = self._create_recommendations(2)[0]
+        headers = {"X-Fields": "id,status"}
+        resp = self.app.get("{0}/{1}".format(BASE_API, test_recommendation.id), headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"id": test_recommendation.id, "status": test_recommendation.status.name})
+        resp = self.app.get(BASE_API, headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertEqual(set(resp.get_json()[0]), {"id", "status"})
+
+    def test_stream_recommendations_ndjson(self):
+        """Stream the list of recommendations as NDJSON"""
+        recommendations = self._create_recommendations(3)
+        resp = self.app.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])["id"], recommendations[0].id)
+
+    def test_stream_recommendations_json(self):
+        """Stream a filtered list of recommendations as a JSON array"""
+        recommendations = self._create_recommendations(3)
+        test_source_id = recommendations[0].src_product_id
+        count = len([rec for rec in recommendations if rec.src_product_id == test_source_id])
+        resp = self.app.get(
+            BASE_URL, query_string="stream=true&src_product_id={}".format(test_source_id)
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), count)
+        resp = self.app.get(BASE_URL, query_string="stream=true&rec_product_id=-1")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_bulk_create_recommendations(self):
+        """Bulk create recommendations from a JSON array"""
+        data = [rec.serialize() for rec in RecommendationFactory.create_batch(3)]
+        data[1]["type"] = "bogus"
+        resp = self.app.post(BASE_URL + "/bulk", json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        result = resp.get_json()
+        self.assertEqual(result["created"], [1, 2])
+        self.assertEqual(len(result["errors"]), 1)
+        self.assertEqual(result["errors"][0]["index"], 1)
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_bulk_create_recommendations_with_bad_rows(self):
+        """Report out of range ids and rows the database rejects per item"""
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE recommendation ADD CONSTRAINT no_13 CHECK (rec_product_id <> 13)"))
+        data = [rec.serialize() for rec in RecommendationFactory.create_batch(4)]
+        data[1]["src_product_id"] = 2 ** 40
+        data[2]["rec_product_id"] = 13
+        resp = self.app.post(BASE_URL + "/bulk", json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        result = resp.get_json()
+        self.assertEqual(len(result["created"]), 2)
+        self.assertEqual([error["index"] for error in result["errors"]], [1, 2])
+        self.assertIn("out of range", result["errors"][0]["message"])
+        self.assertIn("no_13", result["errors"][1]["message"])
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 2)
+
+    def test_bulk_create_recommendations_ndjson(self):
+        """Bulk create recommendations from an NDJSON body"""
+        lines = [json.dumps(rec.serialize()) for rec in RecommendationFactory.create_batch(2)]
+        lines.append("{not json")
+        resp = self.app.post(
+            BASE_URL + "/bulk", data="\n".join(lines), content_type="application/x-ndjson"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        result = resp.get_json()
+        self.assertEqual(len(result["created"]), 2)
+        self.assertEqual(result["errors"][0]["index"], 2)
+
+    def test_bulk_create_recommendations_bad_request(self):
+        """Reject bulk requests with no valid items"""
+        resp = self.app.post(BASE_URL + "/bulk", json={}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(BASE_URL + "/bulk", json=[{}], content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(BASE_URL + "/bulk", data="[]", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_query_by_many_src_product_ids(self):
+        """Query Recommendations for several Source IDs at once"""
+        recommendations = self._create_recommendations(5)
+        source_ids = sorted({rec.src_product_id for rec in recommendations})
+        resp = self.app.get(
+            BASE_URL, query_string="src_product_id={},-1".format(",".join(map(str, source_ids)))
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["-1"], [])
+        self.assertEqual(sum(len(data[str(source_id)]) for source_id in source_ids), 5)
+        for source_id in source_ids:
+            for recommendation in data[str(source_id)]:
+                self.assertEqual(recommendation["src_product_id"], source_id)
+
+    def test_list_top_recommendations(self):
+        """List the highest scored recommendations in score order"""
+        for score in (0.2, 0.9, 0.5, 0.7):
+            data = RecommendationFactory(src_product_id=7, score=score).serialize()
+            resp = self.app.post(BASE_URL, json=data, content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = RecommendationFactory(src_product_id=8, score=1.0).serialize()
+        self.app.post(BASE_URL, json=data, content_type=CONTENT_TYPE_JSON)
+        for base in (BASE_URL, BASE_API):
+            resp = self.app.get(base, query_string="src_product_id=7&top=2")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual([rec["score"] for rec in resp.get_json()], [0.9, 0.7])
+            resp = self.app.get(base, query_string="top=3")
+            self.assertEqual([rec["score"] for rec in resp.get_json()], [1.0, 0.9, 0.7])
+            self.assertNotIn("Link", resp.headers)
+        resp = self.app.get(BASE_API, query_string="src_product_id=7&top=1", headers={"X-Fields": "score"})
+        self.assertEqual(resp.get_json(), [{"score": 0.9}])
+        resp = self.app.get(BASE_URL, query_string="src_product_id=7,8&top=1")
+        self.assertEqual(resp.get_json()["7"][0]["score"], 0.9)
+        self.assertEqual(resp.get_json()["8"][0]["score"], 1.0)
+        resp = self.app.get(BASE_URL, query_string="top=2&stream=true")
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_list_top_recommendations_by_source_not_modified(self):
+        """Tag top lookups of a source apart from its plain listing"""
+        self._create_recommendations(1)
+        source_id = Recommendation.all()[0].src_product_id
+        resp = self.app.get(BASE_URL, query_string="src_product_id={}&top=5".format(source_id))
+        etag = resp.headers["ETag"]
+        plain = self.app.get(BASE_URL, query_string="src_product_id={}".format(source_id))
+        self.assertNotEqual(plain.headers["ETag"], etag)
+        resp = self.app.get(
+            BASE_URL, query_string="src_product_id={}&top=5".format(source_id), headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_top_recommendations_bad_request(self):
+        """Reject an invalid number of top recommendations or score"""
+        for base in (BASE_URL, BASE_API):
+            resp = self.app.get(base, query_string="top=0")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            resp = self.app.get(base, query_string="top=abc")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        data = dict(RecommendationFactory().serialize(), score="high")
+        resp = self.app.post(BASE_URL, json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_by_too_many_src_product_ids(self):
+        """Reject a batch lookup over the limit"""
+        resp = self.app.get(
+            BASE_URL, query_string="src_product_id=" + ",".join(map(str, range(101)))
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL, query_string="src_product_id=1,x")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_by_many_filters(self):
+        """Query Recommendations combining several filters"""
+        recommendations = self._create_recommendations(10)
+        test = recommendations[0]
+        query = "src_product_id={}&type={}&status={}".format(
+            test.src_product_id, test.type.name, test.status.name
+        )
+        expected = [rec for rec in recommendations if rec.src_product_id == test.src_product_id
+                    and rec.type == test.type and rec.status == test.status]
+        for url in (BASE_URL, BASE_API):
+            resp = self.app.get(url, query_string=query)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.get_json()
+            self.assertEqual(len(data), len(expected))
+            for recommendation in data:
+                self.assertEqual(recommendation["src_product_id"], test.src_product_id)
+                self.assertEqual(recommendation["type"], test.type.name)
+                self.assertEqual(recommendation["status"], test.status.name)
+
+    def test_query_by_bad_filter(self):
+        """Reject an unknown type or status"""
+        resp = self.app.get(BASE_URL, query_string="type=bogus")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_API, query_string="status=bogus")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_recommendation_not_found(self):
+        """Update a recommendation that does not exist"""
+        data = RecommendationFactory().serialize()
+        resp = self.app.put("{}/0".format(BASE_URL), json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.put("{}/0".format(BASE_API), json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_enable_recommendation_without_body(self):
+        """Enable a recommendation with an empty body"""
+        recommendation = self._create_recommendations(1)[0]
+        resp = self.app.put("{}/{}/disable".format(BASE_URL, recommendation.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["status"], "DISABLED")
+        resp = self.app.put("{}/{}/enable".format(BASE_URL, recommendation.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["status"], "ENABLED")
+        self.assertEqual(data["src_product_id"], recommendation.src_product_id)
+        self.assertEqual(data["type"], recommendation.type.name)
+
+    def test_enable_recommendation_with_bad_body(self):
+        """Reject an action body that is not a JSON Recommendation"""
+        recommendation = self._create_recommendations(1)[0]
+        url = "{}/{}/disable".format(BASE_URL, recommendation.id)
+        resp = self.app.put(url, data="garbage", content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.put(url, data="garbage", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        resp = self.app.put(url, json={"status": "DISABLED"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("{}/{}".format(BASE_URL, recommendation.id))
+        self.assertEqual(resp.get_json()["status"], recommendation.status.name)
+
+    def test_delete_recommendations_by_source(self):
+        """Delete every recommendation of a source product"""
+        recommendations = self._create_recommendations(10)
+        test_source_id = recommendations[0].src_product_id
+        count = len([rec for rec in recommendations if rec.src_product_id == test_source_id])
+        resp = self.app.delete(BASE_URL, query_string="src_product_id={}".format(test_source_id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["deleted"], count)
+        resp = self.app.get(BASE_URL, query_string="src_product_id={}".format(test_source_id))
+        self.assertEqual(resp.get_json(), [])
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 10 - count)
+
+    def test_delete_recommendations_requires_source(self):
+        """Refuse to delete recommendations without a source product"""
+        self._create_recommendations(2)
+        resp = self.app.delete(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_disable_and_enable_many_recommendations(self):
+        """Disable and enable every recommendation of a recommended product"""
+        recommendations = self._create_recommendations(10)
+        test_rec_id = recommendations[0].rec_product_id
+        count = len([rec for rec in recommendations if rec.rec_product_id == test_rec_id])
+        query = "rec_product_id={}".format(test_rec_id)
+        resp = self.app.put(BASE_URL + "/disable", query_string=query)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["updated"], count)
+        resp = self.app.get(BASE_URL, query_string=query + "&status=ENABLED")
+        self.assertEqual(resp.get_json(), [])
+        resp = self.app.put(BASE_URL + "/enable", query_string=query)
+        self.assertEqual(resp.get_json()["updated"], count)
+        resp = self.app.get(BASE_URL, query_string=query + "&status=DISABLED")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_disable_many_recommendations_requires_filter(self):
+        """Refuse to disable recommendations without a filter"""
+        resp = self.app.put(BASE_URL + "/disable")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_swagger_built_on_first_request(self):
+        """Build the Swagger spec on the first request for it instead of on startup"""
+        output = subprocess.run(
+            [sys.executable, "-c", "from service import routes; print(routes.api._schema is None)"],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        self.assertEqual(output.strip(), "True")
+        resp = self.app.get("/api/swagger.json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("/recommendations", resp.get_json()["paths"])
+        self.assertIsNotNone(api._schema)
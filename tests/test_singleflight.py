@@ -0,0 +1,133 @@
+"""
+Test cases for single-flight read coalescing
+
+"""
+import asyncio
+import threading
+from unittest import TestCase
+from service.utils.singleflight import SingleFlight
+
+
+######################################################################
+#  S I N G L E   F L I G H T   T E S T   C A S E S
+######################################################################
+class TestSingleFlight(TestCase):
+    """ Test Cases for Single Flight """
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.runs = []
+
+    def slow_call(self, value):
+        """Returns a call that blocks until released"""
+        def call():
+            self.runs.append(value)
+            self.started.set()
+            self.release.wait(5)
+            return value
+        return call
+
+    def run_threads(self, count, key, function):
+        """Starts count callers of key, the first of which runs function"""
+        results = []
+        first = threading.Thread(target=lambda: results.append(self.flights.do(key, function)))
+        first.start()
+        self.started.wait(5)
+        others = [
+            threading.Thread(target=lambda: results.append(self.flights.do(key, function)))
+            for _ in range(count - 1)
+        ]
+        for thread in others:
+            thread.start()
+        while self.flights.shared < count - 1:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in [first] + others:
+            thread.join(5)
+        return results
+
+    def test_concurrent_calls_share_one_run(self):
+        """Run a key once for every caller that arrives while it is in flight"""
+        results = self.run_threads(5, "a", self.slow_call(42))
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(self.runs, [42])
+        self.assertEqual(self.flights.stats(), {"enabled": True, "in_flight": 0, "calls": 1, "shared": 4})
+
+    def test_finished_calls_are_not_kept(self):
+        """Run the call again once the previous one has finished"""
+        self.assertEqual(self.flights.do("a", lambda: 1), 1)
+        self.assertEqual(self.flights.do("a", lambda: 2), 2)
+        self.assertEqual(self.flights.do("b", lambda: 3), 3)
+        self.assertEqual(self.flights.stats()["calls"], 3)
+
+    def test_errors_are_shared(self):
+        """Raise the error of the call in every caller that waited for it"""
+        def failing():
+            self.started.set()
+            self.release.wait(5)
+            raise ValueError("boom")
+        errors = []
+
+        def caller():
+            try:
+                self.flights.do("a", failing)
+            except ValueError as error:
+                errors.append(error)
+        threads = [threading.Thread(target=caller) for _ in range(3)]
+        threads[0].start()
+        self.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while self.flights.shared < 2:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(self.flights.stats()["in_flight"], 0)
+
+    def test_forget(self):
+        """Start a new call for callers that arrive after forget()"""
+        first = threading.Thread(target=self.flights.do, args=("a", self.slow_call(1)))
+        first.start()
+        self.started.wait(5)
+        self.flights.forget()
+        self.assertEqual(self.flights.do("a", lambda: 2), 2)
+        self.release.set()
+        first.join(5)
+        self.assertEqual(self.flights.stats()["shared"], 0)
+
+    def test_disabled(self):
+        """Run every call when coalescing is off"""
+        self.flights.configure(False)
+        self.assertEqual(self.flights.do("a", lambda: 1), 1)
+        self.assertEqual(self.flights.stats()["calls"], 0)
+
+    def test_do_async(self):
+        """Share one coroutine between concurrent awaiting callers"""
+        async def load():
+            self.runs.append(1)
+            await asyncio.sleep(0.01)
+            return 7
+
+        async def main():
+            return await asyncio.gather(*(self.flights.do_async("a", load) for _ in range(5)))
+        self.assertEqual(asyncio.run(main()), [7] * 5)
+        self.assertEqual(self.runs, [1])
+        self.assertEqual(self.flights.stats(), {"enabled": True, "in_flight": 0, "calls": 1, "shared": 4})
+
+    def test_do_async_survives_cancelled_caller(self):
+        """Keep the shared call running when one of its callers is cancelled"""
+        async def load():
+            await asyncio.sleep(0.02)
+            return 7
+
+        async def main():
+            first = asyncio.ensure_future(self.flights.do_async("a", load))
+            second = asyncio.ensure_future(self.flights.do_async("a", load))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+        self.assertEqual(asyncio.run(main()), 7)
@@ -0,0 +1,85 @@
+"""
+Test cases for the slow query log
+
+"""
+import json
+import logging
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+from service.utils.slowlog import SlowQueryLog, redact
+
+
+######################################################################
+#  S L O W   Q U E R Y   L O G   T E S T   C A S E S
+######################################################################
+class TestSlowQueryLog(TestCase):
+    """ Test Cases for the Slow Query Log """
+
+    def setUp(self):
+        # one connection shared with the EXPLAIN thread
+        self.engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        self.slow_log = SlowQueryLog()
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def _run(self, statement, **params):
+        """Runs a statement and returns the slow query log lines"""
+        with self.assertLogs("flask.app", logging.WARNING) as logs:
+            with self.engine.connect() as conn:
+                conn.execute(text(statement), params)
+            self.slow_log.wait()
+        return [json.loads(line[line.index("{"):]) for line in logs.output]
+
+    def test_log_slow_query(self):
+        """Log statements over the threshold with redacted parameters"""
+        self.slow_log.configure(0.000001)
+        self.slow_log.attach(self.engine)
+        entry = self._run("SELECT :value", value=42)[0]
+        self.assertEqual(entry["statement"], "SELECT ?")
+        self.assertEqual(entry["parameters"], ["?"])
+        self.assertGreater(entry["duration_ms"], 0)
+        self.assertIsNone(entry["route"])
+
+    def test_log_parameters(self):
+        """Log the parameters when allowed"""
+        self.slow_log.configure(0.000001, log_params=True)
+        self.slow_log.attach(self.engine)
+        entry = self._run("SELECT :value", value=42)[0]
+        self.assertEqual(entry["parameters"], [42])
+
+    def test_log_route(self):
+        """Log the route that ran the statement"""
+        self.slow_log.configure(0.000001)
+        self.slow_log.attach(self.engine)
+        app = Flask(__name__)
+        with app.test_request_context("/recommendations", method="GET"):
+            entry = self._run("SELECT 1")[0]
+        self.assertEqual(entry["route"], "GET /recommendations")
+
+    def test_explain(self):
+        """Log the plan of a slow statement once"""
+        self.slow_log.configure(0.000001, explain=True)
+        self.slow_log.attach(self.engine)
+        entries = self._run("SELECT 1")
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[1]["statement"], "SELECT 1")
+        self.assertTrue(entries[1]["plan"])
+        self.assertEqual(len(self._run("SELECT 1")), 1)
+
+    def test_disabled(self):
+        """Attach nothing when the threshold is 0"""
+        self.slow_log.attach(self.engine)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT 1")).scalar(), 1)
+        self.assertNotIn("slow_query_start", self.engine.raw_connection().info)
+
+    def test_redact(self):
+        """Replace parameter values with placeholders"""
+        self.assertEqual(redact({"id": 1, "name": "x"}), {"id": "?", "name": "?"})
+        self.assertEqual(redact((1, 2)), ["?", "?"])
+        self.assertEqual(redact([{"id": 1}, {"id": 2}]), [{"id": "?"}, {"id": "?"}])
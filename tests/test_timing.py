@@ -0,0 +1,70 @@
+"""
+Test cases for the per-request timing
+
+"""
+import json
+import logging
+from unittest import TestCase
+from flask import Flask, jsonify
+from sqlalchemy import create_engine, text
+from service.utils import timing
+
+
+######################################################################
+#  R E Q U E S T   T I M I N G   T E S T   C A S E S
+######################################################################
+class TestRequestTiming(TestCase):
+    """ Test Cases for Request Timing """
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def _make_app(self, enabled):
+        """Returns an app with one route that runs two queries"""
+        app = Flask(__name__)
+        app.config["REQUEST_TIMING"] = enabled
+        timing.init_app(app)
+
+        @app.route("/")
+        def index():  # pylint: disable=unused-variable
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
+            with timing.measure("serialize"):
+                return jsonify(ok=True)
+
+        return app
+
+    def test_server_timing(self):
+        """Send the handler, SQL and serialization time in Server-Timing"""
+        client = self._make_app(True).test_client()
+        with self.assertLogs("flask.app", logging.INFO) as logs:
+            resp = client.get("/")
+        header = resp.headers["Server-Timing"]
+        self.assertIn('db;dur=', header)
+        self.assertIn('desc="2 queries"', header)
+        self.assertIn("serialize;dur=", header)
+        self.assertIn("total;dur=", header)
+        line = [output for output in logs.output if "request timing" in output][0]
+        fields = json.loads(line.split("request timing ", 1)[1])
+        self.assertEqual(fields["db_queries"], 2)
+        self.assertEqual(fields["endpoint"], "index")
+        self.assertEqual(fields["status"], 200)
+        self.assertIn("serialize_ms", fields)
+
+    def test_disabled(self):
+        """Leave responses alone when REQUEST_TIMING is off"""
+        client = self._make_app(False).test_client()
+        resp = client.get("/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("Server-Timing", resp.headers)
+
+    def test_measure_outside_request(self):
+        """Run measured blocks outside of a request"""
+        with timing.measure("serialize"):
+            value = 1
+        self.assertEqual(value, 1)
+        self.assertIsNone(timing.current_timer())
@@ -0,0 +1,46 @@
+"""
+Test cases for the source product version tags
+
+"""
+import time
+from unittest import TestCase
+from service.utils.versions import VersionTags
+
+
+######################################################################
+#  V E R S I O N   T A G S   T E S T   C A S E S
+######################################################################
+class TestVersionTags(TestCase):
+    """ Test Cases for Version Tags """
+
+    def test_tag_is_stable(self):
+        """Return the same tag until the key is bumped"""
+        versions = VersionTags(maxsize=10, ttl=60)
+        tag = versions.tag(1)
+        self.assertEqual(versions.tag(1), tag)
+        self.assertNotEqual(versions.tag(2), tag)
+
+    def test_bump(self):
+        """Issue a new tag after a bump"""
+        versions = VersionTags(maxsize=10, ttl=60)
+        tag = versions.tag(1)
+        other = versions.tag(2)
+        versions.bump(1)
+        self.assertNotEqual(versions.tag(1), tag)
+        self.assertEqual(versions.tag(2), other)
+
+    def test_tags_expire(self):
+        """Issue a new tag once the old one is older than the TTL"""
+        versions = VersionTags(maxsize=10, ttl=0.01)
+        tag = versions.tag(1)
+        time.sleep(0.02)
+        self.assertNotEqual(versions.tag(1), tag)
+
+    def test_tags_are_unique_per_instance(self):
+        """Never issue the same tag from two counters"""
+        self.assertNotEqual(VersionTags().tag(1), VersionTags().tag(1))
+
+    def test_disabled(self):
+        """Issue a new tag on every lookup when there is no room"""
+        versions = VersionTags(maxsize=0, ttl=60)
+        self.assertNotEqual(versions.tag(1), versions.tag(1))